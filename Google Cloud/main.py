@@ -7,14 +7,30 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy.stats import chi2_contingency
 import statsmodels.api as sm
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import train_test_split, StratifiedKFold
 from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import classification_report, confusion_matrix
+from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, precision_recall_fscore_support
+from joblib import Parallel, delayed
 import io
 import base64
 import json
 import time
 import os
+import hashlib
+import hmac
+import posixpath
+import shutil
+import mmap
+import fcntl
+import threading
+from contextlib import contextmanager
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+import random
+import cProfile
+import pstats
+import marshal
+import tracemalloc
 from google.cloud import storage
 import warnings
 warnings.filterwarnings('ignore') # Ignora avisos para manter a saída do log limpa.
@@ -31,6 +47,311 @@ plt.rcParams['xtick.labelsize'] = 8
 plt.rcParams['ytick.labelsize'] = 8
 plt.rcParams['legend.fontsize'] = 8
 
+# --- Configurações de armazenamento ---
+# O nome do bucket é obtido de uma variável de ambiente, com um fallback genérico.
+# Para fins de demonstração no GitHub, um ID genérico é utilizado.
+BUCKET_DADOS = os.environ.get('GCS_BUCKET', 'seu-bucket-generico-de-dados')
+NOME_ARQUIVO_DADOS = 'cancelamentos.csv'
+# Prefixo dos artefatos de análise pré-calculados, gravados no mesmo bucket dos dados.
+PREFIXO_ARTEFATOS = os.environ.get('ARTIFACTS_PREFIX', 'analises_precalculadas')
+# Backend de armazenamento: 'gcs' (padrão), 'local' (diretório em LOCAL_STORAGE_DIR) ou 'memoria'.
+BACKEND_ARMAZENAMENTO = os.environ.get('STORAGE_BACKEND', 'gcs')
+DIRETORIO_ARMAZENAMENTO_LOCAL = os.environ.get('LOCAL_STORAGE_DIR', 'dados_locais')
+# Arquivos delta do 'append_data' só são lidos sob este prefixo, e a ação exige o token de APPEND_TOKEN.
+PREFIXO_DELTAS = os.environ.get('DELTA_PREFIX', 'deltas')
+TOKEN_INGESTAO = os.environ.get('APPEND_TOKEN')
+
+
+def _validar_inicio_leitura(nome, inicio, tamanho):
+	"""
+	Uma leitura a partir de 'inicio' só faz sentido se o objeto não encolheu. Se encolheu, ele foi
+	substituído em vez de anexado, e os dados precisam ser recarregados por completo.
+	"""
+	if inicio > tamanho:
+		raise ValueError(
+			f"O objeto {nome} tem {tamanho} bytes, menos que os {inicio} já incorporados: "
+			"ele foi substituído, não anexado. Recarregue os dados por completo."
+		)
+
+
+class ArmazenamentoGCS:
+	"""Armazenamento de objetos no Google Cloud Storage. A geração é a 'generation' do objeto."""
+	nome = 'gcs'
+
+	# Após uma falha ao criar o cliente (ex.: sem credenciais), novas tentativas só ocorrem depois deste intervalo.
+	INTERVALO_NOVA_TENTATIVA = float(os.environ.get('GCS_RETRY_SECONDS', 60))
+
+	def __init__(self, nome_bucket):
+		self.nome_bucket = nome_bucket
+		self._bucket = None
+		self._falha_cliente = None # (exceção, instante da falha) da última tentativa de criar o cliente.
+
+	@property
+	def bucket(self):
+		# O cliente é criado sob demanda e reaproveitado entre requisições da mesma instância.
+		# A falha também é guardada, para não repetir a busca de credenciais (lenta) a cada requisição.
+		if self._bucket is None:
+			if self._falha_cliente and time.time() - self._falha_cliente[1] < self.INTERVALO_NOVA_TENTATIVA:
+				raise self._falha_cliente[0]
+			try:
+				self._bucket = storage.Client().bucket(self.nome_bucket)
+				self._falha_cliente = None
+			except Exception as e:
+				self._falha_cliente = (e, time.time())
+				raise
+		return self._bucket
+
+	def ler_texto(self, nome, geracao=None):
+		"""Baixa o objeto como texto e retorna (texto, geração)."""
+		blob = self.bucket.blob(nome, generation=geracao)
+		texto = blob.download_as_text()
+		return texto, blob.generation
+
+	def ler_bytes(self, nome, inicio=0, geracao=None):
+		"""
+		Baixa o objeto a partir do byte 'inicio' e retorna (conteúdo, geração). O tamanho é lido dos
+		metadados antes, porque o GCS responde 416 a uma leitura que começa exatamente no fim do objeto.
+		"""
+		blob = self.bucket.get_blob(nome, generation=geracao)
+		if blob is None:
+			raise FileNotFoundError(f"Objeto não encontrado no GCS: {nome} (geração {geracao}).")
+		_validar_inicio_leitura(nome, inicio, blob.size)
+		if inicio == blob.size:
+			return b'', blob.generation
+		conteudo = blob.download_as_bytes(start=inicio or None)
+		return conteudo, blob.generation
+
+	def obter_geracao(self, nome):
+		"""Retorna a geração atual do objeto (apenas metadados), ou None se não existir."""
+		blob = self.bucket.get_blob(nome)
+		return blob.generation if blob is not None else None
+
+	def existe(self, nome):
+		return self.bucket.blob(nome).exists()
+
+	def gravar_texto(self, nome, texto, content_type='text/plain'):
+		self.bucket.blob(nome).upload_from_string(texto, content_type=content_type)
+
+	def gravar_bytes(self, nome, conteudo, content_type='application/octet-stream'):
+		self.bucket.blob(nome).upload_from_string(conteudo, content_type=content_type)
+
+
+class ArmazenamentoLocal:
+	"""
+	Armazenamento em um diretório local, para execução e testes de carga sem GCS.
+	A geração é o instante de modificação do arquivo em nanossegundos; gerações antigas não são mantidas.
+	"""
+	nome = 'local'
+
+	def __init__(self, diretorio):
+		self.diretorio = diretorio
+
+	def _caminho(self, nome):
+		return os.path.join(self.diretorio, nome)
+
+	def ler_texto(self, nome, geracao=None):
+		geracao_atual = self.obter_geracao(nome)
+		if geracao_atual is None:
+			raise FileNotFoundError(f"Objeto não encontrado no armazenamento local: {self._caminho(nome)}")
+		if geracao is not None and str(geracao) != str(geracao_atual):
+			raise FileNotFoundError(f"Geração {geracao} de {nome} não está disponível no armazenamento local.")
+		# newline='' preserva '\r\n': o texto precisa ter o mesmo tamanho em bytes do arquivo (ver 'offset_dados').
+		with open(self._caminho(nome), encoding='utf-8', newline='') as arquivo:
+			return arquivo.read(), geracao_atual
+
+	def ler_bytes(self, nome, inicio=0, geracao=None):
+		geracao_atual = self.obter_geracao(nome)
+		if geracao_atual is None:
+			raise FileNotFoundError(f"Objeto não encontrado no armazenamento local: {self._caminho(nome)}")
+		if geracao is not None and str(geracao) != str(geracao_atual):
+			raise FileNotFoundError(f"Geração {geracao} de {nome} não está disponível no armazenamento local.")
+		with open(self._caminho(nome), 'rb') as arquivo:
+			_validar_inicio_leitura(nome, inicio, os.fstat(arquivo.fileno()).st_size)
+			arquivo.seek(inicio)
+			return arquivo.read(), geracao_atual
+
+	def obter_geracao(self, nome):
+		caminho = self._caminho(nome)
+		return str(os.stat(caminho).st_mtime_ns) if os.path.exists(caminho) else None
+
+	def existe(self, nome):
+		return os.path.exists(self._caminho(nome))
+
+	def gravar_texto(self, nome, texto, content_type='text/plain'):
+		caminho = self._caminho(nome)
+		os.makedirs(os.path.dirname(caminho), exist_ok=True)
+		with open(caminho, 'w', encoding='utf-8', newline='') as arquivo:
+			arquivo.write(texto)
+
+	def gravar_bytes(self, nome, conteudo, content_type='application/octet-stream'):
+		caminho = self._caminho(nome)
+		os.makedirs(os.path.dirname(caminho), exist_ok=True)
+		with open(caminho, 'wb') as arquivo:
+			arquivo.write(conteudo)
+
+
+class ArmazenamentoMemoria:
+	"""Armazenamento falso em memória, com gerações sequenciais. Útil para testes no mesmo processo."""
+	nome = 'memoria'
+
+	def __init__(self, objetos=None):
+		self.objetos = {} # nome -> (texto, geração)
+		self._ultima_geracao = 0
+		for nome, texto in (objetos or {}).items():
+			self.gravar_texto(nome, texto)
+
+	def ler_texto(self, nome, geracao=None):
+		if nome not in self.objetos:
+			raise FileNotFoundError(f"Objeto não encontrado no armazenamento em memória: {nome}")
+		texto, geracao_atual = self.objetos[nome]
+		if geracao is not None and str(geracao) != str(geracao_atual):
+			raise FileNotFoundError(f"Geração {geracao} de {nome} não está disponível no armazenamento em memória.")
+		if isinstance(texto, bytes): # Objetos gravados com 'gravar_bytes', como no GCS, são decodificados ao ler como texto.
+			texto = texto.decode('utf-8')
+		return texto, geracao_atual
+
+	def ler_bytes(self, nome, inicio=0, geracao=None):
+		if nome not in self.objetos:
+			raise FileNotFoundError(f"Objeto não encontrado no armazenamento em memória: {nome}")
+		conteudo, geracao_atual = self.objetos[nome]
+		if geracao is not None and str(geracao) != str(geracao_atual):
+			raise FileNotFoundError(f"Geração {geracao} de {nome} não está disponível no armazenamento em memória.")
+		if isinstance(conteudo, str):
+			conteudo = conteudo.encode('utf-8')
+		_validar_inicio_leitura(nome, inicio, len(conteudo))
+		return conteudo[inicio:], geracao_atual
+
+	def obter_geracao(self, nome):
+		return self.objetos[nome][1] if nome in self.objetos else None
+
+	def existe(self, nome):
+		return nome in self.objetos
+
+	def gravar_texto(self, nome, texto, content_type='text/plain'):
+		self._ultima_geracao += 1
+		self.objetos[nome] = (texto, str(self._ultima_geracao))
+
+	def gravar_bytes(self, nome, conteudo, content_type='application/octet-stream'):
+		self._ultima_geracao += 1
+		self.objetos[nome] = (bytes(conteudo), str(self._ultima_geracao))
+
+
+_armazenamento = None
+
+
+def nome_arquivo_delta(arquivo_delta):
+	"""
+	Resolve o nome de um arquivo delta, relativo a PREFIXO_DELTAS, no nome do objeto no armazenamento.
+	Levanta ValueError para caminhos absolutos ou com '..', que poderiam sair do prefixo.
+	"""
+	if not isinstance(arquivo_delta, str) or not arquivo_delta.strip():
+		raise ValueError("'delta_file' deve ser o nome de um arquivo.")
+	partes = arquivo_delta.replace('\\', '/').split('/')
+	if arquivo_delta.startswith(('/', '\\')) or ':' in partes[0] or '..' in partes:
+		raise ValueError(f"'delta_file' inválido: {arquivo_delta}. Use um nome relativo ao prefixo '{PREFIXO_DELTAS}'.")
+	return posixpath.join(PREFIXO_DELTAS, posixpath.normpath('/'.join(partes)))
+
+
+def obter_armazenamento():
+	"""Retorna o backend de armazenamento configurado em STORAGE_BACKEND, criado uma única vez por instância."""
+	global _armazenamento
+	if _armazenamento is None:
+		if BACKEND_ARMAZENAMENTO == 'local':
+			_armazenamento = ArmazenamentoLocal(DIRETORIO_ARMAZENAMENTO_LOCAL)
+		elif BACKEND_ARMAZENAMENTO == 'memoria':
+			_armazenamento = ArmazenamentoMemoria()
+		else:
+			_armazenamento = ArmazenamentoGCS(BUCKET_DADOS)
+	return _armazenamento
+
+
+def definir_armazenamento(armazenamento):
+	"""Substitui o backend de armazenamento (ex.: por um ArmazenamentoMemoria em testes)."""
+	global _armazenamento
+	_armazenamento = armazenamento
+
+
+def nome_artefato_analise(geracao):
+	"""Nome do objeto que guarda a 'full_analysis' pré-calculada para uma geração do arquivo de dados."""
+	return f"{PREFIXO_ARTEFATOS}/full_analysis_{geracao}.json"
+
+# --- Configurações da seleção de modelo por validação cruzada ---
+# Grade padrão de valores de regularização 'C', em ordem crescente (do mais regularizado ao menos regularizado),
+# percorrida com warm start em cada fold.
+GRADE_C_PADRAO = [0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0]
+N_FOLDS_PADRAO = 5
+# Limites dos parâmetros enviados pelo cliente e do cache de resultados da validação cruzada.
+MAX_VALORES_GRADE_C = 30
+MAX_N_FOLDS = 20
+MAX_CACHE_VALIDACAO_CRUZADA = 8
+
+# --- Configurações do cubo de segmentos ---
+DIMENSOES_CUBO = ['sexo', 'assinatura', 'duracao_contrato', 'cancelou']
+N_BINS_CUBO = 20 # Número de faixas dos histogramas pré-agregados das variáveis numéricas.
+
+
+def _avaliar_fold_caminho(X, y, indices_treino, indices_validacao, grade_c):
+	"""
+	Treina um único fold ao longo do caminho de regularização, reaproveitando os coeficientes
+	do valor de 'C' anterior (warm start), e retorna as métricas de validação para cada 'C'.
+	Definida no nível do módulo para poder ser executada em paralelo pelo joblib.
+	"""
+	X_tr, y_tr = X[indices_treino], y[indices_treino]
+	X_val, y_val = X[indices_validacao], y[indices_validacao]
+
+	# O solver 'lbfgs' suporta warm_start; o 'liblinear' ignoraria os coeficientes anteriores.
+	modelo = LogisticRegression(max_iter=2000, random_state=42, solver='lbfgs', warm_start=True)
+	metricas = []
+	for c in grade_c:
+		modelo.set_params(C=c)
+		modelo.fit(X_tr, y_tr)
+		y_pred = modelo.predict(X_val)
+		precisao, recall, f1, _ = precision_recall_fscore_support(
+			y_val, y_pred, average='binary', pos_label=1, zero_division=0
+		)
+		metricas.append({
+			'C': float(c),
+			'acuracia': float(accuracy_score(y_val, y_pred)),
+			'precisao': float(precisao),
+			'recall': float(recall),
+			'f1_score': float(f1)
+		})
+	return metricas
+
+
+def _mediana_histograma(bordas, contagens):
+	"""Aproxima a mediana por interpolação linear dentro da faixa do histograma que contém o percentil 50."""
+	acumulado = np.cumsum(contagens)
+	if acumulado[-1] == 0:
+		return float('nan')
+	metade = acumulado[-1] / 2
+	i = int(np.searchsorted(acumulado, metade))
+	anterior = acumulado[i - 1] if i > 0 else 0
+	fracao = (metade - anterior) / contagens[i] if contagens[i] else 0.0
+	return float(bordas[i] + fracao * (bordas[i + 1] - bordas[i]))
+
+
+def _resultado_modelo_com_erro(erro):
+	"""Resultado padrão da etapa de modelo quando o treinamento ou a avaliação falham."""
+	return {
+		'acuracia': "0.00", 'precisao': "0.00", 'recall': "0.00",
+		'f1_score': "0.00", 'matriz_confusao_base64': None, 'erro': str(erro)
+	}
+
+
+def _intervalo_wilson(proporcao, n, z=1.96):
+	"""Intervalo de confiança de Wilson para uma proporção observada em 'n' registros."""
+	if n <= 0:
+		return {'estimativa': round(proporcao, 4), 'ic_inferior': 0.0, 'ic_superior': 1.0}
+	denominador = 1 + z ** 2 / n
+	centro = (proporcao + z ** 2 / (2 * n)) / denominador
+	margem = z * np.sqrt(proporcao * (1 - proporcao) / n + z ** 2 / (4 * n ** 2)) / denominador
+	return {
+		'estimativa': round(proporcao, 4),
+		'ic_inferior': round(float(centro - margem), 4),
+		'ic_superior': round(float(centro + margem), 4)
+	}
+
 
 class AnalisadorCancelamentos:
 	"""
@@ -49,33 +370,54 @@ class AnalisadorCancelamentos:
 		self.y_train = None
 		self.y_test = None
 		self.features_modelo = []
-
-	def carregar_dados(self):
+		self.validacao_cruzada = None # Resultado da seleção de C usada no último treinamento, se houver.
+		self.vetor_risco = None # Probabilidades de cancelamento do modelo atual (ver calcular_vetor_risco).
+		self.versao_dados = None
+		self.geracao_dados = None # Geração do objeto no GCS de onde os dados foram carregados.
+		self.cache_validacao_cruzada = {} # Resultados dos folds por (versão dos dados, grade de C, número de folds).
+		self.info_amostra = None # Preenchido apenas em analisadores de prévia (amostra estratificada).
+		self.cubo = None # Cubo de segmentos pré-agregado (ver construir_cubo_segmentos).
+		self.cubo_risco = None # Contagens por grupo de risco em cada célula do cubo, para o modelo atual.
+		# Estado para incorporação incremental de novas linhas (ver incorporar_novas_linhas).
+		self.colunas_brutas = None # Cabeçalho original do CSV, usado para ler lotes anexados sem cabeçalho.
+		self.offset_dados = None # Quantidade de bytes do arquivo de dados já incorporada.
+		self.deltas_incorporados = {} # Arquivos delta já incorporados: nome -> geração.
+		self.dados_exemplo = False # True quando o carregamento falhou e os dados são sintéticos.
+		self.valores_preenchimento = {} # Mediana/moda usadas no pré-processamento, reaplicadas às novas linhas.
+		self.estatisticas_incrementais = None # Estatísticas mescláveis (contagens, momentos, histogramas, contingências).
+		self.versao_compartilhada = None # Versão da matriz em memória compartilhada anexada por este worker, se houver.
+
+	def carregar_dados(self, geracao=None):
 		"""
-		Tenta carregar o dataset 'cancelamentos.csv' do Google Cloud Storage.
+		Tenta carregar o dataset 'cancelamentos.csv' do backend de armazenamento configurado
+		(Google Cloud Storage por padrão, ou diretório local / memória via STORAGE_BACKEND).
 		Em caso de falha (e se as credenciais GCP não estiverem configuradas),
 		gera dados de exemplo para permitir a continuidade da análise.
+		Se 'geracao' for informada, carrega exatamente essa geração do objeto.
 		"""
-		print("Tentando carregar dados do Google Cloud Storage...")
+		armazenamento = obter_armazenamento()
+		print(f"Tentando carregar dados do armazenamento '{armazenamento.nome}'...")
 		try:
-			client = storage.Client()
-			# O nome do bucket é obtido de uma variável de ambiente, com um fallback genérico.
-			# Para fins de demonstração no GitHub, um ID genérico é utilizado.
-			bucket_name = os.environ.get('GCS_BUCKET', 'seu-bucket-generico-de-dados')
-			bucket = client.bucket(bucket_name)
-			blob = bucket.blob('cancelamentos.csv')
-
-			data = blob.download_as_text()
+			data, self.geracao_dados = armazenamento.ler_texto(NOME_ARQUIVO_DADOS, geracao)
 			self.df = pd.read_csv(io.StringIO(data))
+			self.colunas_brutas = self.df.columns.tolist()
+			self.offset_dados = len(data.encode('utf-8'))
+			self.deltas_incorporados = {}
+			self.dados_exemplo = False
 
-			print(f"Dataset 'cancelamentos.csv' carregado com sucesso do GCS: {self.df.shape[0]} registros e {self.df.shape[1]} variáveis")
+			print(f"Dataset 'cancelamentos.csv' carregado com sucesso ({armazenamento.nome}): {self.df.shape[0]} registros e {self.df.shape[1]} variáveis")
 			return True
 		except Exception as e:
-			print(f"Erro ao carregar dados do Cloud Storage: {e}")
+			print(f"Erro ao carregar dados do armazenamento '{armazenamento.nome}': {e}")
+			if armazenamento.nome != 'gcs':
+				print("Aviso: Arquivo não encontrado no armazenamento de desenvolvimento. Gerando dados de exemplo para continuar.")
+				self.dados_exemplo = True
+				return self.criar_dados_exemplo()
 			print("Verificando se as credenciais do GCP estão configuradas...")
 			# Se as credenciais do GCP não estiverem configuradas, gera dados de exemplo.
 			if not os.environ.get('GOOGLE_APPLICATION_CREDENTIALS') and not os.environ.get('GOOGLE_CLOUD_PROJECT'):
 				print("Aviso: Credenciais do GCP não encontradas ou projeto não configurado. Gerando dados de exemplo para continuar.")
+				self.dados_exemplo = True
 				return self.criar_dados_exemplo()
 			else:
 				print("Erro crítico ao carregar 'cancelamentos.csv' do GCS, e credenciais parecem estar presentes. A Cloud Function pode ter problemas de permissão ou o bucket/arquivo está incorreto.")
@@ -155,6 +497,7 @@ class AnalisadorCancelamentos:
 					self.df[col] = pd.to_numeric(self.df[col], errors='coerce')
 					median_val = self.df[col].median()
 					if pd.isna(median_val): median_val = 0
+					self.valores_preenchimento[col] = median_val
 					self.df[col] = self.df[col].fillna(median_val)
 					self.df[col].replace([np.inf, -np.inf], median_val, inplace=True)
 				else:
@@ -167,12 +510,11 @@ class AnalisadorCancelamentos:
 					self.df[col] = self.df[col].replace(['nan', 'NaN', 'None', ''], pd.NA)
 					try:
 						mode_val = self.df[col].mode()
-						if len(mode_val) > 0:
-							self.df[col] = self.df[col].fillna(mode_val[0])
-						else:
-							self.df[col] = self.df[col].fillna('Desconhecido')
+						self.valores_preenchimento[col] = mode_val[0] if len(mode_val) > 0 else 'Desconhecido'
+						self.df[col] = self.df[col].fillna(self.valores_preenchimento[col])
 					except Exception as e:
 						print(f"Erro ao preencher NaN em coluna categórica {col}: {e}")
+						self.valores_preenchimento[col] = 'Desconhecido'
 						self.df[col] = self.df[col].fillna('Desconhecido')
 				else:
 					print(f"Aviso: Coluna categórica '{col}' não encontrada.")
@@ -205,6 +547,15 @@ class AnalisadorCancelamentos:
 				self.X_processed[col].replace([np.inf, -np.inf], 0, inplace=True)
 
 			self.features_modelo = self.X_processed.columns.tolist()
+			self.cubo = None
+			self.cubo_risco = None
+			self.estatisticas_incrementais = None
+			self.vetor_risco = None
+
+			# Identifica a versão dos dados processados; usada como chave de cache da validação cruzada.
+			hash_dados = hashlib.sha1(pd.util.hash_pandas_object(self.X_processed, index=False).values.tobytes())
+			hash_dados.update(pd.util.hash_pandas_object(self.y_processed, index=False).values.tobytes())
+			self.versao_dados = hash_dados.hexdigest()
 
 			# Divide os dados em conjuntos de treino e teste. O 'stratify' garante que a proporção de 'cancelou'
 			# seja mantida em ambos os conjuntos, o que é importante para variáveis alvo desbalanceadas.
@@ -226,9 +577,112 @@ class AnalisadorCancelamentos:
 			traceback.print_exc()
 			return False
 
-	def analise_exploratoria(self):
-		"""Calcula e retorna estatísticas sumárias básicas do DataFrame."""
+	def construir_cubo_segmentos(self):
+		"""
+		Pré-agrega 'self.df' em um cubo sexo × assinatura × duracao_contrato × cancelou.
+		Cada célula guarda a contagem de registros e, para cada variável numérica, soma, soma dos quadrados,
+		mínimo, máximo e um histograma com bordas fixas, de modo que análises filtradas por segmento
+		possam ser respondidas sem reprocessar as linhas.
+		"""
+		dimensoes = [col for col in DIMENSOES_CUBO if col in self.df.columns]
+		colunas_numericas = [col for col in ['idade', 'frequencia_uso', 'total_gasto', 'ligacoes_callcenter', 'meses_ultima_interacao'] if col in self.df.columns]
+		bordas_histograma = {col: np.histogram_bin_edges(self.df[col].astype(float), bins=N_BINS_CUBO) for col in colunas_numericas}
+
+		self.cubo = {
+			'dimensoes': dimensoes,
+			'colunas_numericas': colunas_numericas,
+			'bordas_histograma': bordas_histograma,
+			'celulas': self._agregar_cubo(self.df, dimensoes, colunas_numericas, bordas_histograma)
+		}
+		self.cubo_risco = None
+		print(f"Cubo de segmentos construído: {len(self.cubo['celulas'])} células.")
+		return self.cubo
+
+	@staticmethod
+	def _agregar_cubo(df, dimensoes, colunas_numericas, bordas_histograma):
+		"""Agrega as linhas de 'df' nas células do cubo, com as bordas de histograma informadas."""
+		base = df[dimensoes].copy()
+		base['n'] = 1
+		base['validos'] = df.notna().all(axis=1).astype(int) # Mesmo critério do 'dropna' na análise sem segmento.
+		for col in colunas_numericas:
+			valores = df[col].astype(float)
+			base[f'{col}_soma'] = valores
+			base[f'{col}_soma_quadrados'] = valores ** 2
+			base[f'{col}_min'] = valores
+			base[f'{col}_max'] = valores
+			# Valores fora das bordas (possíveis em lotes anexados depois) caem na primeira ou na última faixa.
+			indice_bin = np.clip(np.searchsorted(bordas_histograma[col], valores, side='right') - 1, 0, N_BINS_CUBO - 1)
+			for i in range(N_BINS_CUBO):
+				base[f'{col}_h{i}'] = (indice_bin == i).astype(int)
+		return base.groupby(dimensoes, observed=True).agg(AnalisadorCancelamentos._agregacoes_cubo(base.columns, dimensoes))
+
+	@staticmethod
+	def _agregacoes_cubo(colunas, dimensoes):
+		"""Função de agregação de cada coluna do cubo: mínimo, máximo ou soma."""
+		return {c: ('min' if c.endswith('_min') else 'max' if c.endswith('_max') else 'sum') for c in colunas if c not in dimensoes}
+
+	def _construir_cubo_risco(self):
+		"""Agrega, por célula do cubo, a contagem de clientes em cada grupo de risco do modelo atual."""
+		dimensoes = self.cubo['dimensoes']
+		base = self.df[dimensoes].copy()
+		base['grupo_risco'] = pd.qcut(self.calcular_vetor_risco(),
+									  q=[0, 0.25, 0.75, 1.0],
+									  labels=['Baixo Risco', 'Médio Risco', 'Alto Risco'],
+									  duplicates='drop')
+		self.cubo_risco = base.groupby(dimensoes + ['grupo_risco'], observed=True).size().unstack('grupo_risco', fill_value=0)
+		return self.cubo_risco
+
+	def _filtrar_cubo(self, tabela, segmento):
+		"""Seleciona as células de 'tabela' (indexada pelas dimensões do cubo) que pertencem ao segmento."""
+		mascara = np.ones(len(tabela), dtype=bool)
+		for dimensao, valores in segmento.items():
+			if dimensao not in tabela.index.names:
+				raise ValueError(f"Dimensão de segmento inválida: {dimensao}. Use uma de {self.cubo['dimensoes']}.")
+			valores = valores if isinstance(valores, list) else [valores]
+			nivel = tabela.index.get_level_values(dimensao).astype(str)
+			mascara &= nivel.isin([str(v) for v in valores])
+		return tabela[mascara]
+
+	def consultar_cubo(self, segmento):
+		"""Retorna as células do cubo que pertencem ao segmento, construindo o cubo se necessário."""
+		if self.cubo is None:
+			self.construir_cubo_segmentos()
+		celulas = self._filtrar_cubo(self.cubo['celulas'], segmento)
+		if celulas['n'].sum() == 0:
+			raise ValueError(f"Nenhum registro encontrado para o segmento {segmento}.")
+		return celulas
+
+	def _tabela_contingencia(self, col, segmento=None):
+		"""
+		Tabela de contingência 'col' × 'cancelou', a partir das linhas, do cubo quando há segmento,
+		ou das contagens mantidas no modo incremental.
+		"""
+		if segmento:
+			celulas = self.consultar_cubo(segmento)
+			return celulas.groupby(level=[col, 'cancelou'])['n'].sum().unstack('cancelou', fill_value=0)
+		if self.estatisticas_incrementais is not None and col in self.estatisticas_incrementais['contingencia']:
+			return self.estatisticas_incrementais['contingencia'][col]
+		temp_df = self.df.dropna(subset=[col, 'cancelou'])
+		return pd.crosstab(temp_df[col], temp_df['cancelou'])
+
+	def analise_exploratoria(self, segmento=None):
+		"""
+		Calcula e retorna estatísticas sumárias básicas do DataFrame.
+		Com 'segmento' (ex.: {'assinatura': 'Premium'}), as estatísticas do segmento são lidas do cubo,
+		incluindo um resumo das variáveis numéricas com histogramas pré-agregados.
+		"""
 		try:
+			if segmento:
+				return self._analise_exploratoria_segmento(segmento)
+			if self.estatisticas_incrementais is not None:
+				# Modo incremental: contagens mantidas a cada lote, sem percorrer as linhas.
+				estado = self.estatisticas_incrementais
+				return {
+					'total_registros': estado['n'],
+					'total_variaveis': int(len(self.df.columns)),
+					'taxa_cancelamento': round(estado['cancelados'] / estado['n'] * 100, 2),
+					'registros_validos': estado['validos']
+				}
 			stats = {
 				'total_registros': int(len(self.df)),
 				'total_variaveis': int(len(self.df.columns)),
@@ -240,10 +694,61 @@ class AnalisadorCancelamentos:
 			print(f"Erro na análise exploratória: {e}")
 			return {'erro': str(e)}
 
-	def gerar_distribuicoes(self):
+	def _analise_exploratoria_segmento(self, segmento):
+		"""Estatísticas sumárias de um segmento, calculadas a partir das células do cubo."""
+		celulas = self.consultar_cubo(segmento)
+		total = float(celulas['n'].sum())
+		cancelados = float(celulas.xs(1, level='cancelou')['n'].sum()) if 1 in celulas.index.get_level_values('cancelou') else 0.0
+
+		resumo_numerico = {}
+		for col in self.cubo['colunas_numericas']:
+			media = celulas[f'{col}_soma'].sum() / total
+			variancia = max(celulas[f'{col}_soma_quadrados'].sum() / total - media ** 2, 0.0)
+			resumo_numerico[col] = {
+				'media': round(float(media), 2),
+				'desvio_padrao': round(float(np.sqrt(variancia)), 2),
+				'minimo': round(float(celulas[f'{col}_min'].min()), 2),
+				'maximo': round(float(celulas[f'{col}_max'].max()), 2),
+				'histograma': {
+					'bordas': [round(float(b), 4) for b in self.cubo['bordas_histograma'][col]],
+					'contagens': [int(celulas[f'{col}_h{i}'].sum()) for i in range(N_BINS_CUBO)]
+				}
+			}
+
+		return {
+			'segmento': segmento,
+			'total_registros': int(total),
+			'total_variaveis': int(len(self.df.columns)),
+			'taxa_cancelamento': round(cancelados / total * 100, 2),
+			'registros_validos': int(celulas['validos'].sum()),
+			'resumo_numerico': resumo_numerico
+		}
+
+	def _estatisticas_numericas_segmento(self, segmento):
+		"""
+		Estado agregado das variáveis numéricas de um segmento, lido do cubo, no mesmo formato
+		das estatísticas incrementais (n, média, mínimo, máximo, bordas e histograma).
+		"""
+		celulas = self.consultar_cubo(segmento)
+		total = float(celulas['n'].sum())
+		numericas = {}
+		for col in self.cubo['colunas_numericas']:
+			numericas[col] = {
+				'n': int(total),
+				'media': float(celulas[f'{col}_soma'].sum() / total),
+				'min': float(celulas[f'{col}_min'].min()),
+				'max': float(celulas[f'{col}_max'].max()),
+				'bordas': self.cubo['bordas_histograma'][col],
+				'histograma': np.array([celulas[f'{col}_h{i}'].sum() for i in range(N_BINS_CUBO)], dtype=float)
+			}
+		return {'numericas': numericas}
+
+	def gerar_distribuicoes(self, segmento=None):
 		"""
 		Gera e retorna gráficos de distribuição (histogramas) para variáveis numéricas,
 		incluindo média e mediana, como uma imagem Base64.
+		No modo incremental, histogramas e médias vêm das estatísticas mescláveis e a mediana
+		é interpolada no histograma. Com 'segmento', os histogramas do segmento são lidos do cubo.
 		"""
 		try:
 			numeric_cols = ['idade', 'frequencia_uso', 'total_gasto', 'ligacoes_callcenter', 'meses_ultima_interacao']
@@ -252,6 +757,8 @@ class AnalisadorCancelamentos:
 			if not existing_cols:
 				return {'erro': 'Nenhuma coluna numérica encontrada para distribuição'}
 
+			# Estado agregado (cubo do segmento ou estatísticas incrementais); sem ele, usa as linhas.
+			estado_incremental = self._estatisticas_numericas_segmento(segmento) if segmento else self.estatisticas_incrementais
 			n_cols_plot = len(existing_cols)
 			n_rows_plot = (n_cols_plot + 1) // 2
 
@@ -267,16 +774,25 @@ class AnalisadorCancelamentos:
 				if i < len(axes):
 					ax = axes[i]
 					try:
-						data = self.df[col].dropna()
-						if len(data) == 0 or data.nunique() == 1:
+						estado = estado_incremental['numericas'].get(col) if estado_incremental else None
+						if estado is not None:
+							constante = estado['n'] == 0 or estado['min'] == estado['max']
+						else:
+							data = self.df[col].dropna()
+							constante = len(data) == 0 or data.nunique() == 1
+						if constante:
 							ax.text(0.5, 0.5, f'Sem dados ou dados constantes para {col}', 
 											ha='center', va='center', transform=ax.transAxes, fontsize=8)
 							ax.set_title(f'Distribuição de {col.replace("_", " ").title()}', 
 											fontweight='bold', fontsize=10)
 							continue
 
-						bins_to_use = min(20, data.nunique()) if data.nunique() > 1 else 1
-						ax.hist(data, bins=bins_to_use, edgecolor='black', alpha=0.7, color='skyblue')
+						if estado is not None:
+							ax.hist(estado['bordas'][:-1], bins=estado['bordas'], weights=estado['histograma'],
+									edgecolor='black', alpha=0.7, color='skyblue')
+						else:
+							bins_to_use = min(20, data.nunique()) if data.nunique() > 1 else 1
+							ax.hist(data, bins=bins_to_use, edgecolor='black', alpha=0.7, color='skyblue')
 
 						ax.set_title(f'Distribuição de {col.replace("_", " ").title()}', 
 											fontweight='bold', fontsize=10)
@@ -284,8 +800,12 @@ class AnalisadorCancelamentos:
 						ax.set_ylabel('Frequência', fontsize=8)
 						ax.grid(True, linestyle='--', alpha=0.7)
 
-						mean_val = data.mean()
-						median_val = data.median()
+						if estado is not None:
+							mean_val = estado['media']
+							median_val = _mediana_histograma(estado['bordas'], estado['histograma'])
+						else:
+							mean_val = data.mean()
+							median_val = data.median()
 
 						ax.axvline(mean_val, color='red', linestyle='--', linewidth=1, 
 											label=f'Média: {mean_val:.2f}')
@@ -309,6 +829,19 @@ class AnalisadorCancelamentos:
 			img_buffer.seek(0)
 			img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
 
+			if estado_incremental is not None:
+				medias = {col: e['media'] for col, e in estado_incremental['numericas'].items()}
+				resultado = {
+					'idade_media': round(float(medias.get('idade', 0)), 2),
+					'freq_uso_media': round(float(medias.get('frequencia_uso', 0)), 2),
+					'gasto_medio': round(float(medias.get('total_gasto', 0)), 2),
+					'ligacoes_media': round(float(medias.get('ligacoes_callcenter', 0)), 2),
+					'imagem_base64': img_base64
+				}
+				if segmento:
+					resultado['segmento'] = segmento
+				return resultado
+
 			stats = {
 				'idade_media': round(float(self.df['idade'].mean()) if 'idade' in self.df.columns else 0, 2),
 				'freq_uso_media': round(float(self.df['frequencia_uso'].mean()) if 'frequencia_uso' in self.df.columns else 0, 2),
@@ -322,10 +855,11 @@ class AnalisadorCancelamentos:
 			print(f"Erro ao gerar distribuições: {e}")
 			return {'erro': str(e)}
 
-	def analisar_associacoes(self):
+	def analisar_associacoes(self, segmento=None):
 		"""
 		Realiza testes Qui-quadrado para variáveis categóricas e gera gráficos
 		da taxa de cancelamento por categoria, retornando os resultados e as imagens.
+		Com 'segmento', as tabelas de contingência são lidas do cubo, sem reprocessar as linhas.
 		"""
 		try:
 			categorical_cols = ['sexo', 'assinatura', 'duracao_contrato']
@@ -334,11 +868,9 @@ class AnalisadorCancelamentos:
 
 			for col in categorical_cols:
 				if col in self.df.columns:
-					temp_df = self.df.dropna(subset=[col, 'cancelou'])
-					if not temp_df.empty and len(temp_df[col].unique()) > 1:
+					tabela = self._tabela_contingencia(col, segmento)
+					if not tabela.empty and tabela.shape[0] > 1:
 						try:
-							tabela = pd.crosstab(temp_df[col], temp_df['cancelou'])
-
 							if tabela.shape[0] > 1 and tabela.shape[1] > 1:
 								qui2, p, gl, esperado = chi2_contingency(tabela)
 
@@ -373,9 +905,9 @@ class AnalisadorCancelamentos:
 				for i, col in enumerate(categorical_cols):
 					if col in self.df.columns and plot_count < len(axes):
 						ax = axes[plot_count]
-						temp_df = self.df.dropna(subset=[col, 'cancelou'])
-						if not temp_df.empty:
-							tabela_pct = pd.crosstab(temp_df[col], temp_df['cancelou'], normalize='index') * 100
+						tabela = self._tabela_contingencia(col, segmento)
+						if not tabela.empty:
+							tabela_pct = tabela.div(tabela.sum(axis=1), axis=0) * 100
 
 							if 1 in tabela_pct.columns:
 								tabela_pct[1].sort_values(ascending=False).plot(
@@ -408,34 +940,131 @@ class AnalisadorCancelamentos:
 				img_buffer.seek(0)
 				img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
 
-			return {
+			resultado = {
 				'testes': testes,
 				'imagem_base64': img_base64
 			}
+			if segmento:
+				resultado['segmento'] = segmento
+			return resultado
 		except Exception as e:
 			print(f"Erro na análise de associações: {e}")
 			return {'erro': str(e)}
 
-	def construir_modelo(self):
+	def selecionar_regularizacao(self, grade_c=None, n_folds=None):
+		"""
+		Executa validação cruzada estratificada (k-fold) sobre o conjunto de treino para escolher
+		o valor de regularização 'C' da Regressão Logística. Os folds são treinados em paralelo
+		em todos os núcleos disponíveis e os resultados ficam em cache por versão dos dados.
+		"""
+		grade_c = sorted(float(c) for c in (grade_c or GRADE_C_PADRAO))
+		n_folds = int(n_folds or N_FOLDS_PADRAO)
+
+		chave_cache = (self.versao_dados, tuple(grade_c), n_folds)
+		if chave_cache in self.cache_validacao_cruzada:
+			print("Reutilizando resultados da validação cruzada em cache para esta versão dos dados.")
+			return self.cache_validacao_cruzada[chave_cache]
+
+		X = self.X_train.to_numpy(dtype=float)
+		y = self.y_train.to_numpy()
+		skf = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=42)
+
+		print(f"Iniciando validação cruzada: {n_folds} folds x {len(grade_c)} valores de C...")
+		resultados_folds = Parallel(n_jobs=-1)(
+			delayed(_avaliar_fold_caminho)(X, y, indices_treino, indices_validacao, grade_c)
+			for indices_treino, indices_validacao in skf.split(X, y)
+		)
+
+		# Agrega média e desvio padrão de cada métrica, para cada valor de C, entre os folds.
+		caminho = []
+		for i, c in enumerate(grade_c):
+			metricas_c = {'C': c}
+			for metrica in ['acuracia', 'precisao', 'recall', 'f1_score']:
+				valores = [fold[i][metrica] for fold in resultados_folds]
+				metricas_c[metrica] = round(float(np.mean(valores)), 4)
+				metricas_c[f'{metrica}_desvio'] = round(float(np.std(valores)), 4)
+			caminho.append(metricas_c)
+
+		# Escolhe o C com maior F1 médio da classe 'cancelou'; em caso de empate, o mais regularizado.
+		melhor = max(caminho, key=lambda m: (m['f1_score'], -m['C']))
+
+		resultado = {
+			'C_escolhido': melhor['C'],
+			'n_folds': n_folds,
+			'caminho_regularizacao': caminho,
+			'melhor': melhor
+		}
+		# Mantém apenas resultados da versão atual dos dados, e no máximo MAX_CACHE_VALIDACAO_CRUZADA deles.
+		self.cache_validacao_cruzada = {
+			chave: valor for chave, valor in self.cache_validacao_cruzada.items() if chave[0] == self.versao_dados
+		}
+		while len(self.cache_validacao_cruzada) >= MAX_CACHE_VALIDACAO_CRUZADA:
+			self.cache_validacao_cruzada.pop(next(iter(self.cache_validacao_cruzada)))
+		self.cache_validacao_cruzada[chave_cache] = resultado
+		return resultado
+
+	def construir_modelo(self, selecao_modelo=False, grade_c=None, n_folds=None):
 		"""
 		Constrói e treina um modelo de Regressão Logística para prever cancelamentos.
 		Avalia o modelo utilizando os conjuntos de teste e retorna métricas de desempenho
 		e a matriz de confusão como uma imagem Base64.
+		Com 'selecao_modelo' ativo, o valor de 'C' é escolhido por validação cruzada estratificada
+		e as métricas médias dos folds são retornadas junto às métricas do conjunto de teste.
 		"""
 		try:
-			# Verifica se os dados de treino/teste estão disponíveis; se não, tenta pré-processar novamente.
-			if self.X_train is None or self.X_test is None or self.y_train is None or self.y_test is None:
-				print("Dados de treino/teste não divididos. Tentando pré-processar e dividir novamente.")
-				if not self.preprocessar_dados():
-					raise ValueError("Dados insuficientes ou erro no pré-processamento para treinar o modelo.")
-
-			# Garante que a variável target tenha mais de uma classe para o treinamento do modelo.
-			if len(self.y_train.unique()) < 2:
-				raise ValueError("Não há variação suficiente na variável target 'cancelou' para treinar o modelo.")
+			self.treinar_modelo(selecao_modelo, grade_c, n_folds)
+		except Exception as e:
+			print(f"Erro ao construir modelo: {e}")
+			import traceback
+			traceback.print_exc()
+			return _resultado_modelo_com_erro(e)
+		return self.avaliar_modelo()
 
-			# Inicializa e treina o modelo de Regressão Logística.
-			self.modelo = LogisticRegression(max_iter=2000, random_state=42, solver='liblinear', n_jobs=-1, C=0.1)
-			self.modelo.fit(self.X_train, self.y_train)
+	def treinar_modelo(self, selecao_modelo=False, grade_c=None, n_folds=None):
+		"""
+		Treina o modelo de Regressão Logística (sem avaliação nem gráficos).
+		Levanta exceção se os dados não permitirem o treinamento.
+		"""
+		# Verifica se os dados de treino/teste estão disponíveis; se não, tenta pré-processar novamente.
+		if self.X_train is None or self.X_test is None or self.y_train is None or self.y_test is None:
+			print("Dados de treino/teste não divididos. Tentando pré-processar e dividir novamente.")
+			if not self.preprocessar_dados():
+				raise ValueError("Dados insuficientes ou erro no pré-processamento para treinar o modelo.")
+
+		# Garante que a variável target tenha mais de uma classe para o treinamento do modelo.
+		if len(self.y_train.unique()) < 2:
+			raise ValueError("Não há variação suficiente na variável target 'cancelou' para treinar o modelo.")
+
+		validacao_cruzada = None
+		if selecao_modelo:
+			validacao_cruzada = self.selecionar_regularizacao(grade_c, n_folds)
+			modelo = LogisticRegression(max_iter=2000, random_state=42, solver='lbfgs', C=validacao_cruzada['C_escolhido'])
+		elif self.estatisticas_incrementais is not None and self.modelo is not None and self.modelo.coef_.shape[1] == self.X_train.shape[1]:
+			# Modo incremental: continua a partir dos coeficientes do modelo anterior (warm start com 'lbfgs';
+			# o 'liblinear' não suporta warm start), em vez de treinar do zero.
+			modelo_anterior = self.modelo
+			modelo = LogisticRegression(max_iter=2000, random_state=42, solver='lbfgs', warm_start=True, C=modelo_anterior.C)
+			modelo.coef_ = modelo_anterior.coef_.copy()
+			modelo.intercept_ = modelo_anterior.intercept_.copy()
+		else:
+			# Inicializa o modelo de Regressão Logística com a regularização padrão.
+			# O 'liblinear' é single-thread em problemas binários, por isso não há 'n_jobs'.
+			modelo = LogisticRegression(max_iter=2000, random_state=42, solver='liblinear', C=0.1)
+		# O modelo só substitui o atual depois de treinado, para que etapas concorrentes nunca vejam um modelo sem ajuste.
+		modelo.fit(self.X_train, self.y_train)
+		self.modelo = modelo
+		self.validacao_cruzada = validacao_cruzada
+		self.vetor_risco = None
+		self.cubo_risco = None
+		return self.modelo
+
+	def avaliar_modelo(self):
+		"""
+		Avalia o modelo já treinado no conjunto de teste e retorna as métricas e a matriz
+		de confusão como uma imagem Base64 (junto às métricas da validação cruzada, se houver).
+		"""
+		try:
+			validacao_cruzada = self.validacao_cruzada
 
 			y_pred = self.modelo.predict(self.X_test) # Faz previsões no conjunto de teste.
 			# Gera um relatório de classificação com métricas detalhadas.
@@ -475,7 +1104,7 @@ class AnalisadorCancelamentos:
 				recall_1 = report.get('weighted avg', {}).get('recall', 0)
 				f1_1 = report.get('weighted avg', {}).get('f1-score', 0)
 
-			return {
+			resultado = {
 				'acuracia': f"{accuracy:.2f}",
 				'precisao': f"{precision_1:.2f}",
 				'recall': f"{recall_1:.2f}",
@@ -483,14 +1112,34 @@ class AnalisadorCancelamentos:
 				'matriz_confusao_base64': matriz_base64
 			}
 
+			if validacao_cruzada is not None:
+				melhor = validacao_cruzada['melhor']
+				resultado['validacao_cruzada'] = {
+					'C_escolhido': validacao_cruzada['C_escolhido'],
+					'n_folds': validacao_cruzada['n_folds'],
+					'acuracia_cv': f"{melhor['acuracia']:.2f} ± {melhor['acuracia_desvio']:.2f}",
+					'precisao_cv': f"{melhor['precisao']:.2f} ± {melhor['precisao_desvio']:.2f}",
+					'recall_cv': f"{melhor['recall']:.2f} ± {melhor['recall_desvio']:.2f}",
+					'f1_score_cv': f"{melhor['f1_score']:.2f} ± {melhor['f1_score_desvio']:.2f}",
+					'caminho_regularizacao': validacao_cruzada['caminho_regularizacao']
+				}
+
+			return resultado
+
 		except Exception as e:
-			print(f"Erro ao construir modelo: {e}")
+			print(f"Erro ao avaliar modelo: {e}")
 			import traceback
 			traceback.print_exc()
-			return {
-				'acuracia': "0.00", 'precisao': "0.00", 'recall': "0.00",
-				'f1_score': "0.00", 'matriz_confusao_base64': None, 'erro': str(e)
-			}
+			return _resultado_modelo_com_erro(e)
+
+	def calcular_vetor_risco(self):
+		"""
+		Retorna a probabilidade de cancelamento de todos os clientes segundo o modelo atual.
+		O vetor é calculado uma vez por modelo treinado e compartilhado entre as etapas que o usam.
+		"""
+		if self.vetor_risco is None or len(self.vetor_risco) != len(self.X_processed):
+			self.vetor_risco = self.modelo.predict_proba(self.X_processed)[:, 1]
+		return self.vetor_risco
 
 	def analisar_fatores_risco(self):
 		"""
@@ -602,9 +1251,8 @@ class AnalisadorCancelamentos:
 			if 'ligacoes_callcenter' not in self.df.columns:
 				return {'erro': 'Coluna "ligacoes_callcenter" não encontrada para análise de call center.'}
 
-			# Certifica-se de que 'risco_cancelamento' está no df.
-			if 'risco_cancelamento' not in self.df.columns:
-				self.df['risco_cancelamento'] = self.modelo.predict_proba(self.X_processed)[:, 1]
+			# Atualiza 'risco_cancelamento' com o vetor de risco do modelo atual.
+			self.df['risco_cancelamento'] = self.calcular_vetor_risco()
 
 			fig, ax = plt.subplots(figsize=(8, 6)) 
 
@@ -652,10 +1300,12 @@ class AnalisadorCancelamentos:
 			traceback.print_exc()
 			return {'erro': str(e)}
 
-	def gerar_insights(self):
+	def gerar_insights(self, segmento=None):
 		"""
 		Segmenta os clientes em grupos de risco (Baixo, Médio, Alto) com base na probabilidade
 		de cancelamento do modelo, gera um gráfico da segmentação e fornece recomendações de negócio.
+		Com 'segmento', as contagens por grupo vêm do cubo (os limites dos grupos continuam sendo
+		os quantis de risco da base completa).
 		"""
 		try:
 			if self.modelo is None or self.X_processed is None:
@@ -664,19 +1314,27 @@ class AnalisadorCancelamentos:
 				if 'erro' in modelo_result:
 					return {'erro': 'Não foi possível construir o modelo para gerar insights'}
 
-			# Calcula a probabilidade de cancelamento para todos os clientes.
-			risco = self.modelo.predict_proba(self.X_processed)[:, 1]
+			if segmento:
+				celulas = self.consultar_cubo(segmento)
+				if self.cubo_risco is None:
+					self._construir_cubo_risco()
+				contagens = self._filtrar_cubo(self.cubo_risco, segmento).sum()
+				total_clientes = int(celulas['n'].sum())
+			else:
+				# Calcula a probabilidade de cancelamento para todos os clientes.
+				risco = self.calcular_vetor_risco()
 
-			df_temp = self.df.copy()
-			df_temp['risco_cancelamento'] = risco
+				df_temp = self.df.copy()
+				df_temp['risco_cancelamento'] = risco
 
-			# Usa qcut para segmentação em quartis de risco.
-			df_temp['grupo_risco'] = pd.qcut(df_temp['risco_cancelamento'],
-											 q=[0, 0.25, 0.75, 1.0],
-											 labels=['Baixo Risco', 'Médio Risco', 'Alto Risco'],
-											 duplicates='drop')
+				# Usa qcut para segmentação em quartis de risco.
+				df_temp['grupo_risco'] = pd.qcut(df_temp['risco_cancelamento'],
+												 q=[0, 0.25, 0.75, 1.0],
+												 labels=['Baixo Risco', 'Médio Risco', 'Alto Risco'],
+												 duplicates='drop')
 
-			contagens = df_temp['grupo_risco'].value_counts()
+				contagens = df_temp['grupo_risco'].value_counts()
+				total_clientes = int(len(df_temp))
 
 			fig, ax = plt.subplots(figsize=(8, 6)) 
 
@@ -720,35 +1378,1071 @@ class AnalisadorCancelamentos:
 				"Desenvolver programas de fidelidade com base na 'Duração do Contrato' e 'Frequência de Uso'."
 			]
 
-			return {
+			resultado = {
 				'alto_risco': int(contagens.get('Alto Risco', 0)),
 				'medio_risco': int(contagens.get('Médio Risco', 0)),
 				'baixo_risco': int(contagens.get('Baixo Risco', 0)),
-				'total_clientes': int(len(df_temp)),
+				'total_clientes': total_clientes,
 				'recomendacoes': recomendacoes,
 				'segmentacao_base64': segmentacao_base64
 			}
+			if segmento:
+				resultado['segmento'] = segmento
+			return resultado
 		except Exception as e:
 			print(f"Erro ao gerar insights: {e}")
 			import traceback
 			traceback.print_exc()
 			return {'erro': str(e)}
 
+	def criar_amostra_estratificada(self, tamanho_amostra):
+		"""
+		Cria um novo analisador com uma amostra estratificada de 'self.df', com alocação proporcional
+		nos estratos definidos por 'cancelou' e pelas colunas categóricas. Cada estrato mantém ao menos
+		um registro, para que categorias raras continuem aparecendo na prévia.
+		"""
+		colunas_estrato = [col for col in ['cancelou', 'sexo', 'assinatura', 'duracao_contrato'] if col in self.df.columns]
+		total_populacao = len(self.df)
+		fracao = min(1.0, float(tamanho_amostra) / total_populacao) if total_populacao else 1.0
+
+		rng = np.random.default_rng(42)
+		posicoes_amostra = []
+		for posicoes in self.df.groupby(colunas_estrato, sort=False).indices.values():
+			n_estrato = min(len(posicoes), max(1, int(round(len(posicoes) * fracao))))
+			posicoes_amostra.append(rng.choice(posicoes, size=n_estrato, replace=False))
+		posicoes_amostra = np.sort(np.concatenate(posicoes_amostra))
+
+		amostra = AnalisadorCancelamentos()
+		# 'risco_cancelamento' vem do modelo completo e não pode ser reaproveitado na prévia.
+		amostra.df = self.df.iloc[posicoes_amostra].drop(columns=['risco_cancelamento'], errors='ignore').reset_index(drop=True)
+		amostra.info_amostra = {
+			'colunas_estrato': colunas_estrato,
+			'tamanhos_populacao': self.df.groupby(colunas_estrato).size().rename('N').reset_index(),
+			'total_populacao': total_populacao
+		}
+		print(f"Amostra estratificada criada: {len(amostra.df)} de {total_populacao} registros ({len(posicoes_amostra) / total_populacao:.1%}).")
+
+		if not amostra.preprocessar_dados():
+			return None
+		return amostra
+
+	def calcular_intervalos_preview(self, z=1.96):
+		"""
+		Calcula estimativas com intervalos de confiança para os resultados de uma prévia
+		gerada por 'criar_amostra_estratificada'.
+		- Taxa de cancelamento e qui-quadrado: como 'cancelou' e as categóricas definem os estratos,
+		  as tabelas de contingência da população são conhecidas pelos tamanhos dos estratos e os valores são exatos.
+		- Médias numéricas: estimador estratificado com correção para população finita.
+		- Métricas do modelo: intervalo de Wilson sobre o conjunto de teste da amostra.
+		"""
+		info = self.info_amostra
+		estratos_populacao = info['tamanhos_populacao']
+		total_populacao = info['total_populacao']
+		intervalos = {}
+
+		if 'cancelou' in info['colunas_estrato']:
+			taxa = float((estratos_populacao['N'] * estratos_populacao['cancelou']).sum() / total_populacao) * 100
+			intervalos['taxa_cancelamento'] = {
+				'estimativa': round(taxa, 2), 'ic_inferior': round(taxa, 2), 'ic_superior': round(taxa, 2),
+				'erro_padrao': 0.0, 'exato_por_estratificacao': True
+			}
+
+		testes = []
+		for col in ['sexo', 'assinatura', 'duracao_contrato']:
+			if col in info['colunas_estrato'] and 'cancelou' in info['colunas_estrato']:
+				tabela = estratos_populacao.pivot_table(index=col, columns='cancelou', values='N', aggfunc='sum', fill_value=0)
+				if tabela.shape[0] > 1 and tabela.shape[1] > 1:
+					qui2, p, gl, esperado = chi2_contingency(tabela)
+					testes.append({
+						'variavel': col, 'qui_quadrado': round(float(qui2), 2),
+						'ic_inferior': round(float(qui2), 2), 'ic_superior': round(float(qui2), 2),
+						'p_valor': f"{p:.6f}", 'exato_por_estratificacao': True
+					})
+		intervalos['qui_quadrado'] = testes
+
+		# Estimador estratificado da média: soma de W_h * média_h, com variância
+		# soma de W_h^2 * (1 - n_h/N_h) * s_h^2 / n_h.
+		# Amostra e população são alinhadas pela tupla de valores do estrato, não pela posição.
+		tamanhos_estrato = estratos_populacao.set_index(info['colunas_estrato'])['N']
+		tamanhos = tamanhos_estrato.to_numpy(dtype=float)
+		pesos = tamanhos / total_populacao
+		medias = {}
+		for col in ['idade', 'frequencia_uso', 'total_gasto', 'ligacoes_callcenter', 'meses_ultima_interacao']:
+			if col in self.df.columns:
+				grupos = self.df.groupby(info['colunas_estrato'])[col]
+				media_h = grupos.mean().reindex(tamanhos_estrato.index).to_numpy(dtype=float)
+				var_h = grupos.var(ddof=1).reindex(tamanhos_estrato.index).fillna(0).to_numpy(dtype=float)
+				n_h = grupos.size().reindex(tamanhos_estrato.index).to_numpy(dtype=float)
+				estimativa = float(np.sum(pesos * media_h))
+				erro_padrao = float(np.sqrt(np.sum(pesos ** 2 * (1 - n_h / tamanhos) * var_h / n_h)))
+				medias[col] = {
+					'estimativa': round(estimativa, 2),
+					'ic_inferior': round(estimativa - z * erro_padrao, 2),
+					'ic_superior': round(estimativa + z * erro_padrao, 2),
+					'erro_padrao': round(erro_padrao, 4)
+				}
+		intervalos['medias'] = medias
+
+		if self.modelo is not None and self.y_test is not None:
+			acuracia = float(accuracy_score(self.y_test, self.modelo.predict(self.X_test)))
+			intervalos['acuracia_modelo'] = _intervalo_wilson(acuracia, len(self.y_test), z)
+
+		return intervalos
+
+	def _limpar_novas_linhas(self, novo_df):
+		"""
+		Aplica a um lote de novas linhas a mesma limpeza de 'preprocessar_dados', reaproveitando
+		as medianas e modas calculadas no pré-processamento completo (não recalculadas a cada lote).
+		"""
+		novo_df = novo_df.dropna(subset=['cancelou']).copy()
+		novo_df['cancelou'] = pd.to_numeric(novo_df['cancelou'], errors='coerce').fillna(0).astype(int)
+		novo_df.columns = novo_df.columns.str.strip().str.lower().str.replace(' ', '_')
+
+		for col in ['idade', 'frequencia_uso', 'total_gasto', 'ligacoes_callcenter', 'meses_ultima_interacao']:
+			if col in novo_df.columns:
+				valor = self.valores_preenchimento.get(col, 0)
+				novo_df[col] = pd.to_numeric(novo_df[col], errors='coerce').fillna(valor).replace([np.inf, -np.inf], valor)
+
+		for col in ['sexo', 'assinatura', 'duracao_contrato']:
+			if col in novo_df.columns:
+				novo_df[col] = novo_df[col].astype(str).str.strip().replace(['nan', 'NaN', 'None', ''], pd.NA)
+				novo_df[col] = novo_df[col].fillna(self.valores_preenchimento.get(col, 'Desconhecido'))
+		return novo_df
+
+	def _estatisticas_lote(self, df, bordas_histograma):
+		"""Calcula o estado mesclável (contagens, momentos, histogramas e contingências) de um lote de linhas."""
+		estatisticas = {
+			'n': int(len(df)),
+			'cancelados': int(df['cancelou'].sum()),
+			'validos': int(len(df.dropna())),
+			'numericas': {},
+			'contingencia': {}
+		}
+		for col, bordas in bordas_histograma.items():
+			valores = df[col].astype(float).to_numpy()
+			indice_bin = np.clip(np.searchsorted(bordas, valores, side='right') - 1, 0, len(bordas) - 2)
+			estatisticas['numericas'][col] = {
+				'n': len(valores),
+				'media': float(valores.mean()) if len(valores) else 0.0,
+				'm2': float(((valores - valores.mean()) ** 2).sum()) if len(valores) else 0.0,
+				'min': float(valores.min()) if len(valores) else np.inf,
+				'max': float(valores.max()) if len(valores) else -np.inf,
+				'bordas': bordas,
+				'histograma': np.bincount(indice_bin, minlength=len(bordas) - 1)
+			}
+		for col in ['sexo', 'assinatura', 'duracao_contrato']:
+			if col in df.columns:
+				estatisticas['contingencia'][col] = pd.crosstab(df[col], df['cancelou'])
+		return estatisticas
+
+	@staticmethod
+	def _mesclar_estatisticas(a, b):
+		"""Mescla dois estados; médias e somas de quadrados dos desvios pela fórmula de Chan et al."""
+		mescladas = {
+			'n': a['n'] + b['n'],
+			'cancelados': a['cancelados'] + b['cancelados'],
+			'validos': a['validos'] + b['validos'],
+			'numericas': {},
+			'contingencia': {}
+		}
+		for col, ea in a['numericas'].items():
+			eb = b['numericas'][col]
+			n = ea['n'] + eb['n']
+			delta = eb['media'] - ea['media']
+			mescladas['numericas'][col] = {
+				'n': n,
+				'media': ea['media'] + delta * eb['n'] / n if n else 0.0,
+				'm2': ea['m2'] + eb['m2'] + delta ** 2 * ea['n'] * eb['n'] / n if n else 0.0,
+				'min': min(ea['min'], eb['min']),
+				'max': max(ea['max'], eb['max']),
+				'bordas': ea['bordas'],
+				'histograma': ea['histograma'] + eb['histograma']
+			}
+		for col, tabela in a['contingencia'].items():
+			mescladas['contingencia'][col] = tabela.add(b['contingencia'].get(col, pd.DataFrame()), fill_value=0).fillna(0).astype(int)
+		return mescladas
+
+	def incorporar_novas_linhas(self, novo_df):
+		"""
+		Incorpora um lote de linhas anexadas sem reprocessar a base: limpa apenas o lote, mescla as
+		estatísticas incrementais (e o cubo de segmentos, se existir), estende a matriz de features e as
+		divisões de treino/teste. O próximo 'construir_modelo' parte dos coeficientes atuais (warm start).
+		"""
+		if self.X_processed is None:
+			raise ValueError("Os dados precisam ser carregados e pré-processados antes de incorporar novas linhas.")
+		if 'cancelou' not in novo_df.columns:
+			raise ValueError("Coluna 'cancelou' não encontrada nas novas linhas.")
+
+		novo_df = self._limpar_novas_linhas(novo_df)
+		if novo_df.empty:
+			return 0
+		novo_df.index = pd.RangeIndex(self.df.index.max() + 1, self.df.index.max() + 1 + len(novo_df))
+
+		colunas_numericas = [col for col in ['idade', 'frequencia_uso', 'total_gasto', 'ligacoes_callcenter', 'meses_ultima_interacao'] if col in self.df.columns]
+		if self.estatisticas_incrementais is None:
+			# Primeiro lote: o estado da base atual é calculado uma única vez.
+			bordas = {col: np.histogram_bin_edges(self.df[col].astype(float), bins=N_BINS_CUBO) for col in colunas_numericas}
+			self.estatisticas_incrementais = self._estatisticas_lote(self.df, bordas)
+		bordas = {col: e['bordas'] for col, e in self.estatisticas_incrementais['numericas'].items()}
+		self.estatisticas_incrementais = self._mesclar_estatisticas(self.estatisticas_incrementais, self._estatisticas_lote(novo_df, bordas))
+
+		if self.cubo is not None:
+			novas_celulas = self._agregar_cubo(novo_df, self.cubo['dimensoes'], self.cubo['colunas_numericas'], self.cubo['bordas_histograma'])
+			celulas = pd.concat([self.cubo['celulas'], novas_celulas])
+			self.cubo['celulas'] = celulas.groupby(level=self.cubo['dimensoes'], observed=True).agg(
+				self._agregacoes_cubo(celulas.columns, self.cubo['dimensoes'])
+			)
+		self.cubo_risco = None
+		self.vetor_risco = None
+
+		# Dummies sem 'drop_first', reindexadas para as features do modelo: um lote pequeno pode não ter
+		# todas as categorias, e a categoria de referência precisa ser a mesma da base.
+		colunas_categoricas = [col for col in ['sexo', 'assinatura', 'duracao_contrato'] if col in novo_df.columns]
+		features_lote = colunas_numericas + colunas_categoricas
+		X_novo = pd.get_dummies(novo_df[features_lote], columns=colunas_categoricas, dtype=int)
+		X_novo = X_novo.reindex(columns=self.features_modelo, fill_value=0).apply(pd.to_numeric, errors='coerce').fillna(0)
+		y_novo = novo_df['cancelou'].copy()
+
+		if len(novo_df) >= 4:
+			estratificar = y_novo if y_novo.value_counts().min() >= 2 and y_novo.nunique() > 1 else None
+			X_tr, X_te, y_tr, y_te = train_test_split(X_novo, y_novo, test_size=0.25, random_state=42, stratify=estratificar)
+		else:
+			X_tr, X_te, y_tr, y_te = X_novo, X_novo.iloc[0:0], y_novo, y_novo.iloc[0:0]
+
+		# 'risco_cancelamento' é do modelo anterior e será recalculado.
+		self.df = pd.concat([self.df.drop(columns=['risco_cancelamento'], errors='ignore'), novo_df])
+		self.X_processed = pd.concat([self.X_processed, X_novo])
+		self.y_processed = pd.concat([self.y_processed, y_novo])
+		self.X_train, self.X_test = pd.concat([self.X_train, X_tr]), pd.concat([self.X_test, X_te])
+		self.y_train, self.y_test = pd.concat([self.y_train, y_tr]), pd.concat([self.y_test, y_te])
+
+		# Encadeia a versão dos dados com o hash do lote, sem reprocessar as linhas anteriores.
+		hash_dados = hashlib.sha1((self.versao_dados or '').encode())
+		hash_dados.update(pd.util.hash_pandas_object(X_novo, index=False).values.tobytes())
+		hash_dados.update(pd.util.hash_pandas_object(y_novo, index=False).values.tobytes())
+		self.versao_dados = hash_dados.hexdigest()
+
+		print(f"Incorporadas {len(novo_df)} novas linhas. Total: {len(self.df)} registros.")
+		return int(len(novo_df))
+
+	def carregar_novos_dados(self, arquivo_delta=None):
+		"""
+		Lê apenas as linhas novas e as incorpora com 'incorporar_novas_linhas'.
+		Sem 'arquivo_delta', lê o arquivo de dados a partir do último byte já incorporado (arquivo só cresce por anexação);
+		com 'arquivo_delta', lê esse objeto (CSV com cabeçalho) sob PREFIXO_DELTAS. Um delta já incorporado
+		(mesmo nome e geração) é ignorado, para que reenvios não dupliquem linhas.
+		"""
+		armazenamento = obter_armazenamento()
+		if arquivo_delta:
+			nome_delta = nome_arquivo_delta(arquivo_delta)
+			texto, geracao_delta = armazenamento.ler_texto(nome_delta)
+			if self.deltas_incorporados.get(nome_delta) == str(geracao_delta):
+				print(f"Delta {nome_delta} (geração {geracao_delta}) já incorporado; ignorando.")
+				return {'novas_linhas': 0, 'total_registros': int(len(self.df)), 'offset': self.offset_dados, 'ja_incorporado': True}
+			novo_df = pd.read_csv(io.StringIO(texto))
+			novas_linhas = self.incorporar_novas_linhas(novo_df)
+			self.deltas_incorporados[nome_delta] = str(geracao_delta)
+			return {'novas_linhas': novas_linhas, 'total_registros': int(len(self.df)), 'offset': self.offset_dados}
+		else:
+			if self.offset_dados is None or self.colunas_brutas is None:
+				raise ValueError("Os dados atuais não vieram do arquivo no armazenamento; use um arquivo delta.")
+			conteudo, geracao = armazenamento.ler_bytes(NOME_ARQUIVO_DADOS, self.offset_dados)
+			if not conteudo.strip():
+				return {'novas_linhas': 0, 'total_registros': int(len(self.df)), 'offset': self.offset_dados}
+			# Considera apenas linhas completas; uma linha parcial fica para o próximo lote.
+			fim = conteudo.rfind(b'\n') + 1
+			if fim == 0:
+				return {'novas_linhas': 0, 'total_registros': int(len(self.df)), 'offset': self.offset_dados}
+			novo_df = pd.read_csv(io.BytesIO(conteudo[:fim]), header=None, names=self.colunas_brutas)
+			self.offset_dados += fim
+			self.geracao_dados = geracao
+
+		novas_linhas = self.incorporar_novas_linhas(novo_df)
+		return {'novas_linhas': novas_linhas, 'total_registros': int(len(self.df)), 'offset': self.offset_dados}
+
+	def publicar_memoria_compartilhada(self, diretorio):
+		"""
+		Publica a matriz de features, os rótulos, o vetor de risco e as colunas do DataFrame como arquivos
+		'.npy' em 'diretorio' (idealmente em /dev/shm), para que outros workers os mapeiem em memória sem cópia.
+		As linhas são gravadas com o conjunto de treino primeiro e o de teste depois, de modo que as
+		divisões de treino/teste sejam fatias contíguas (views) da mesma matriz.
+		A publicação é atômica: os arquivos vão para um subdiretório da versão e o ponteiro 'atual.json'
+		é substituído por último.
+		"""
+		if self.modelo is None:
+			self.treinar_modelo()
+
+		ordem = self.X_train.index.tolist() + self.X_test.index.tolist()
+		colunas_numericas = [col for col in ['idade', 'frequencia_uso', 'total_gasto', 'ligacoes_callcenter', 'meses_ultima_interacao'] if col in self.df.columns]
+		colunas_categoricas = [col for col in ['sexo', 'assinatura', 'duracao_contrato'] if col in self.df.columns]
+
+		versao = f"{self.versao_dados[:16]}_{uuid.uuid4().hex[:8]}"
+		diretorio_versao = os.path.join(diretorio, versao)
+		os.makedirs(diretorio_versao, exist_ok=True)
+
+		X = np.ascontiguousarray(self.X_processed.loc[ordem].to_numpy(dtype=np.float64))
+		np.save(os.path.join(diretorio_versao, 'X.npy'), X)
+		np.save(os.path.join(diretorio_versao, 'y.npy'), self.y_processed.loc[ordem].to_numpy(dtype=np.int64))
+		np.save(os.path.join(diretorio_versao, 'risco.npy'), self.modelo.predict_proba(self.X_processed.loc[ordem])[:, 1])
+		np.save(os.path.join(diretorio_versao, 'df_numericas.npy'),
+				np.ascontiguousarray(self.df.loc[ordem, colunas_numericas].to_numpy(dtype=np.float64)))
+
+		categorias = {}
+		codigos = np.empty((len(ordem), len(colunas_categoricas)), dtype=np.int16)
+		for j, col in enumerate(colunas_categoricas):
+			categorico = self.df.loc[ordem, col].astype('category')
+			categorias[col] = categorico.cat.categories.tolist()
+			codigos[:, j] = categorico.cat.codes.to_numpy()
+		np.save(os.path.join(diretorio_versao, 'df_categoricas.npy'), codigos)
+
+		metadados = {
+			'versao': versao,
+			'versao_dados': self.versao_dados,
+			'geracao_dados': None if self.geracao_dados is None else str(self.geracao_dados),
+			'features_modelo': self.features_modelo,
+			'colunas_numericas': colunas_numericas,
+			'colunas_categoricas': colunas_categoricas,
+			'categorias': categorias,
+			'n_treino': len(self.X_train),
+			'valores_preenchimento': {col: (valor.item() if hasattr(valor, 'item') else valor) for col, valor in self.valores_preenchimento.items()},
+			# Estado da ingestão incremental, para que qualquer worker anexado possa executar o 'append_data'.
+			'colunas_brutas': self.colunas_brutas,
+			'offset_dados': self.offset_dados,
+			'deltas_incorporados': self.deltas_incorporados,
+			'modelo': {
+				'C': float(self.modelo.C),
+				'solver': self.modelo.solver,
+				'coef': self.modelo.coef_.tolist(),
+				'intercept': self.modelo.intercept_.tolist(),
+				'classes': self.modelo.classes_.tolist()
+			},
+			'publicado_em': time.time()
+		}
+		with open(os.path.join(diretorio_versao, 'metadados.json'), 'w', encoding='utf-8') as arquivo:
+			json.dump(metadados, arquivo, ensure_ascii=False)
+
+		ponteiro_temporario = os.path.join(diretorio, f'.atual_{versao}.json')
+		with open(ponteiro_temporario, 'w', encoding='utf-8') as arquivo:
+			json.dump({'versao': versao}, arquivo)
+		os.replace(ponteiro_temporario, os.path.join(diretorio, 'atual.json'))
+
+		# Versões antigas podem ser removidas: no Linux, workers que ainda as mapeiam mantêm o acesso até liberá-las.
+		for nome in os.listdir(diretorio):
+			caminho = os.path.join(diretorio, nome)
+			if nome != versao and os.path.isdir(caminho):
+				shutil.rmtree(caminho, ignore_errors=True)
+
+		print(f"Matriz publicada em memória compartilhada: {diretorio_versao} ({X.nbytes / 1024 ** 2:.1f} MB de features).")
+		return versao
+
+	def anexar_memoria_compartilhada(self, diretorio):
+		"""
+		Mapeia (somente leitura, sem cópia) os arrays publicados por 'publicar_memoria_compartilhada' e
+		monta sobre eles o DataFrame, a matriz de features, as divisões de treino/teste, o vetor de risco e o modelo.
+		Retorna a versão anexada, ou None se nada tiver sido publicado ainda.
+		"""
+		versao = _versao_publicada(diretorio)
+		if versao is None:
+			return None
+		diretorio_versao = os.path.join(diretorio, versao)
+		with open(os.path.join(diretorio_versao, 'metadados.json'), encoding='utf-8') as arquivo:
+			metadados = json.load(arquivo)
+
+		def mapear(nome):
+			return np.load(os.path.join(diretorio_versao, nome), mmap_mode='r')
+
+		X, y = mapear('X.npy'), mapear('y.npy')
+		n_treino = metadados['n_treino']
+
+		# 'copy=False' mantém os DataFrames como views dos arquivos mapeados; as fatias por posição também são views.
+		self.X_processed = pd.DataFrame(X, columns=metadados['features_modelo'], copy=False)
+		self.y_processed = pd.Series(y, name='cancelou', copy=False)
+		self.X_train, self.X_test = self.X_processed.iloc[:n_treino], self.X_processed.iloc[n_treino:]
+		self.y_train, self.y_test = self.y_processed.iloc[:n_treino], self.y_processed.iloc[n_treino:]
+
+		self.df = pd.DataFrame(mapear('df_numericas.npy'), columns=metadados['colunas_numericas'], copy=False)
+		codigos = mapear('df_categoricas.npy')
+		for j, col in enumerate(metadados['colunas_categoricas']):
+			self.df[col] = pd.Categorical.from_codes(codigos[:, j], categories=metadados['categorias'][col])
+		self.df['cancelou'] = self.y_processed
+
+		dados_modelo = metadados['modelo']
+		modelo = LogisticRegression(max_iter=2000, random_state=42, solver=dados_modelo['solver'], C=dados_modelo['C'])
+		modelo.classes_ = np.array(dados_modelo['classes'])
+		modelo.coef_ = np.array(dados_modelo['coef'])
+		modelo.intercept_ = np.array(dados_modelo['intercept'])
+		modelo.n_features_in_ = len(metadados['features_modelo'])
+		modelo.feature_names_in_ = np.array(metadados['features_modelo'], dtype=object)
+		self.modelo = modelo
+		self.vetor_risco = mapear('risco.npy')
+
+		self.features_modelo = metadados['features_modelo']
+		self.valores_preenchimento = metadados['valores_preenchimento']
+		self.colunas_brutas = metadados.get('colunas_brutas')
+		self.offset_dados = metadados.get('offset_dados')
+		self.deltas_incorporados = dict(metadados.get('deltas_incorporados') or {})
+		self.versao_dados = metadados['versao_dados']
+		self.geracao_dados = metadados['geracao_dados']
+		self.versao_compartilhada = versao
+		self.validacao_cruzada = None
+		self.cubo = None
+		self.cubo_risco = None
+		self.estatisticas_incrementais = None
+		print(f"Worker {os.getpid()} anexado à matriz compartilhada {versao}: {X.shape[0]} registros.")
+		return versao
+
+	def relatorio_memoria(self):
+		"""
+		Relatório de memória deste worker: RSS/PSS do processo (PSS divide as páginas compartilhadas
+		entre os processos que as mapeiam) e, para cada estrutura grande, seu tamanho e se ela é privada
+		ou mapeada da memória compartilhada.
+		"""
+		relatorio = {'pid': os.getpid(), 'versao_compartilhada': self.versao_compartilhada}
+		try:
+			with open('/proc/self/smaps_rollup', encoding='utf-8') as arquivo:
+				for linha in arquivo:
+					chave, _, valor = linha.partition(':')
+					if chave in ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty'):
+						relatorio[f'{chave.lower()}_mb'] = round(int(valor.split()[0]) / 1024, 1)
+		except OSError:
+			import resource
+			relatorio['rss_maximo_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+		def descrever(objeto):
+			if objeto is None:
+				return None
+			valores = objeto if isinstance(objeto, np.ndarray) else objeto.to_numpy()
+			base = valores
+			while getattr(base, 'base', None) is not None and not isinstance(base, np.memmap):
+				base = base.base
+			return {
+				'mb': round(valores.nbytes / 1024 ** 2, 2),
+				'compartilhado': isinstance(base, np.memmap) or isinstance(base, mmap.mmap)
+			}
+
+		relatorio['estruturas'] = {
+			'X_processed': descrever(self.X_processed),
+			'y_processed': descrever(self.y_processed),
+			'X_train': descrever(self.X_train),
+			'X_test': descrever(self.X_test),
+			'vetor_risco': descrever(self.vetor_risco),
+			'df_memoria_mb': round(float(self.df.memory_usage(deep=True).sum()) / 1024 ** 2, 2) if self.df is not None else None
+		}
+		return relatorio
+
 
 analisador = AnalisadorCancelamentos()
 
+# Tamanho padrão da amostra usada no modo 'preview'.
+TAMANHO_AMOSTRA_PREVIEW = int(os.environ.get('PREVIEW_SAMPLE_SIZE', 2000))
+# Execuções do pipeline (inclusive em segundo plano) alteram o estado do analisador e são serializadas.
+trava_pipeline = threading.Lock()
+# O pyplot mantém estado global, então as etapas que geram gráficos não rodam simultaneamente.
+trava_graficos = threading.Lock()
+# Resultados dos refinamentos exatos disparados a partir de uma prévia, indexados pelo id do refinamento.
+# Também são gravados no armazenamento (ver '_registrar_refinamento'); esta é só a cópia local da instância.
+# Um resultado concluído é removido da memória ao ser consultado; os não consultados expiram após REFINEMENT_TTL_SECONDS
+# e, acima de REFINEMENT_MAX_ENTRIES, os mais antigos são descartados.
+resultados_refinamento = {}
+TTL_REFINAMENTO = float(os.environ.get('REFINEMENT_TTL_SECONDS', 600))
+MAX_REFINAMENTOS = int(os.environ.get('REFINEMENT_MAX_ENTRIES', 20))
+
+
+def _limpar_refinamentos():
+	"""Descarta refinamentos expirados e, se ainda houver excesso, os mais antigos."""
+	limite = time.time() - TTL_REFINAMENTO
+	for id_refinamento, registro in list(resultados_refinamento.items()):
+		if registro['status'] != 'executando' and registro['timestamp'] < limite:
+			resultados_refinamento.pop(id_refinamento, None)
+	excedentes = len(resultados_refinamento) - MAX_REFINAMENTOS
+	if excedentes > 0:
+		antigos = sorted(
+			(registro['timestamp'], id_refinamento) for id_refinamento, registro in list(resultados_refinamento.items())
+			if registro['status'] != 'executando'
+		)
+		for _, id_refinamento in antigos[:excedentes]:
+			resultados_refinamento.pop(id_refinamento, None)
+
+
+# --- Agendador de etapas ---
+# Com PARALLEL_STEPS=1, os nós do grafo rodam em um pool de threads; por padrão rodam em sequência.
+ETAPAS_PARALELAS = os.environ.get('PARALLEL_STEPS', '0') == '1'
+# Estado por thread da execução atual (ex.: se a requisição está sendo perfilada).
+_contexto_execucao = threading.local()
+
+# Intermediários compartilhados entre etapas, com suas dependências. Cada um é calculado no máximo uma vez por execução.
+def _garantir_matriz(alvo, refazer_modelo, opcoes_modelo):
+	if alvo.X_processed is None and not alvo.preprocessar_dados():
+		raise ValueError("Erro no pré-processamento dos dados.")
+
+
+def _garantir_modelo(alvo, refazer_modelo, opcoes_modelo):
+	if refazer_modelo or alvo.modelo is None:
+		alvo.treinar_modelo(**opcoes_modelo)
+
+
+def _garantir_vetor_risco(alvo, refazer_modelo, opcoes_modelo):
+	alvo.calcular_vetor_risco()
+
+
+INTERMEDIARIOS = {
+	'matriz_preprocessada': ([], _garantir_matriz),
+	'modelo_ajustado': (['matriz_preprocessada'], _garantir_modelo),
+	'vetor_risco': (['modelo_ajustado'], _garantir_vetor_risco)
+}
+
+# Etapas disponíveis: intermediários de que dependem e a função que produz o resultado.
+ETAPAS = {
+	'exploratorio': (['matriz_preprocessada'], lambda alvo, segmento: alvo.analise_exploratoria(segmento)),
+	'distribuicoes': (['matriz_preprocessada'], lambda alvo, segmento: alvo.gerar_distribuicoes(segmento)),
+	'associacoes': (['matriz_preprocessada'], lambda alvo, segmento: alvo.analisar_associacoes(segmento)),
+	'modelo': (['modelo_ajustado'], lambda alvo, segmento: alvo.avaliar_modelo()),
+	'fatores_risco': (['modelo_ajustado'], lambda alvo, segmento: alvo.analisar_fatores_risco()),
+	'call_center_impact': (['vetor_risco'], lambda alvo, segmento: alvo.analisar_impacto_callcenter()),
+	'insights': (['vetor_risco'], lambda alvo, segmento: alvo.gerar_insights(segmento))
+}
+
+# Etapas que respeitam o 'segmento'. As demais (modelo e derivados) cobrem toda a base e, quando há
+# segmento, são marcadas com 'segmento': None para não serem apresentadas como resultados do segmento.
+ETAPAS_SEGMENTAVEIS = {'exploratorio', 'distribuicoes', 'associacoes', 'insights'}
+
+# Chaves das etapas no resultado da 'full_analysis', na ordem da apresentação.
+CHAVES_ANALISE_COMPLETA = {
+	'exploratorio': 'analise_exploratoria',
+	'distribuicoes': 'distribuicoes',
+	'associacoes': 'associacoes',
+	'modelo': 'modelo',
+	'fatores_risco': 'fatores_risco',
+	'call_center_impact': 'call_center_impact',
+	'insights': 'insights'
+}
+
+
+def _ordenar_dependencias(etapas):
+	"""Resolve as etapas pedidas e seus intermediários em uma ordem topológica."""
+	ordem = []
+
+	def visitar(no):
+		if no in ordem:
+			return
+		dependencias = ETAPAS[no][0] if no in ETAPAS else INTERMEDIARIOS[no][0]
+		for dependencia in dependencias:
+			visitar(dependencia)
+		ordem.append(no)
+
+	for etapa in etapas:
+		visitar(etapa)
+	return ordem
+
+
+def _marcar_segmento(resultados, segmento):
+	"""Marca com 'segmento': None os resultados de etapas que não são filtradas pelo segmento pedido."""
+	if segmento:
+		for etapa, resultado in resultados.items():
+			if etapa not in ETAPAS_SEGMENTAVEIS and isinstance(resultado, dict):
+				resultado['segmento'] = None
+	return resultados
+
+
+def executar_etapas(alvo, etapas, opcoes_modelo=None, segmento=None):
+	"""
+	Executa uma lista arbitrária de etapas como um grafo de dependências: cada intermediário
+	(matriz pré-processada, modelo ajustado, vetor de risco) é calculado uma única vez. O treinamento
+	do modelo é refeito apenas se a etapa 'modelo' for pedida (como na análise completa), se ainda
+	não houver modelo ou se houver seleção de modelo.
+	Por padrão os nós rodam em sequência na thread da requisição. Com PARALLEL_STEPS=1 rodam em um
+	pool de threads, mas as etapas geram gráficos com o pyplot, que não é thread-safe, e se revezam em
+	'trava_graficos'; só os intermediários se sobrepõem a elas, e nas medições isso não reduziu a latência.
+	Retorna um dicionário {etapa: resultado}. Levanta ValueError para etapas desconhecidas.
+	"""
+	opcoes_modelo = opcoes_modelo or {}
+	etapas = list(dict.fromkeys(etapas))
+	invalidas = [etapa for etapa in etapas if etapa not in ETAPAS]
+	if invalidas:
+		raise ValueError(f"Etapas inválidas: {invalidas}. Use uma de {list(ETAPAS)}.")
+	refazer_modelo = 'modelo' in etapas or bool(opcoes_modelo.get('selecao_modelo'))
+
+	ordem = _ordenar_dependencias(etapas)
+	futuros = {}
+
+	def executar_no(no):
+		dependencias = ETAPAS[no][0] if no in ETAPAS else INTERMEDIARIOS[no][0]
+		try:
+			for dependencia in dependencias:
+				futuros[dependencia].result()
+		except Exception as e:
+			if no not in ETAPAS:
+				raise
+			print(f"Etapa '{no}' não executada: falha em uma dependência: {e}")
+			return _resultado_modelo_com_erro(e) if no == 'modelo' else {'erro': f'Falha em uma dependência da etapa: {e}'}
+
+		if no in ETAPAS:
+			with trava_graficos:
+				return ETAPAS[no][1](alvo, segmento)
+		inicio = time.time()
+		INTERMEDIARIOS[no][1](alvo, refazer_modelo, opcoes_modelo)
+		print(f"Intermediário '{no}' pronto em {time.time() - inicio:.2f}s.")
+
+	with trava_pipeline:
+		if not ETAPAS_PARALELAS or getattr(_contexto_execucao, 'perfilando', False):
+			# Execução na própria thread, na ordem topológica. O cProfile só registra a thread em que
+			# foi habilitado, então requisições perfiladas sempre passam por aqui.
+			for no in ordem:
+				futuros[no] = Future()
+				try:
+					futuros[no].set_result(executar_no(no))
+				except Exception as e:
+					futuros[no].set_exception(e)
+			return _marcar_segmento({etapa: futuros[etapa].result() for etapa in etapas}, segmento)
+
+		# Um worker por nó: cada tarefa pode bloquear esperando suas dependências sem esgotar o pool.
+		with ThreadPoolExecutor(max_workers=len(ordem)) as executor:
+			for no in ordem:
+				futuros[no] = executor.submit(executar_no, no)
+			return _marcar_segmento({etapa: futuros[etapa].result() for etapa in etapas}, segmento)
+
+
+def executar_analise_completa(alvo, opcoes_modelo=None, segmento=None):
+	"""
+	Executa todas as etapas da análise sobre o analisador informado.
+	O 'segmento' filtra as etapas respondidas pelo cubo (exploratória, distribuições, associações e segmentação
+	de risco); as demais cobrem toda a base e vêm marcadas com 'segmento': None.
+	"""
+	resultados = executar_etapas(alvo, list(CHAVES_ANALISE_COMPLETA), opcoes_modelo, segmento)
+	return {chave: resultados[etapa] for etapa, chave in CHAVES_ANALISE_COMPLETA.items()}
+
+
+def executar_etapa(alvo, step, opcoes_modelo=None, segmento=None):
+	"""Executa uma única etapa da análise. Retorna None se a etapa não existir."""
+	if step not in ETAPAS:
+		return None
+	return executar_etapas(alvo, [step], opcoes_modelo, segmento)[step]
+
+
+def nome_resultado_refinamento(id_refinamento):
+	"""Nome do objeto que guarda o estado/resultado de um refinamento, ao lado dos artefatos pré-calculados."""
+	return f"{PREFIXO_ARTEFATOS}/refinamentos/{id_refinamento}.json"
+
+
+def _registrar_refinamento(id_refinamento, registro):
+	"""
+	Guarda o estado do refinamento na memória desta instância e no armazenamento, para que
+	'refinement_status' funcione em qualquer instância. Falhas ao gravar mantêm só a cópia local.
+	"""
+	resultados_refinamento[id_refinamento] = registro
+	try:
+		obter_armazenamento().gravar_texto(
+			nome_resultado_refinamento(id_refinamento), json.dumps(registro, ensure_ascii=False), content_type='application/json'
+		)
+	except Exception as e:
+		print(f"Não foi possível gravar o refinamento {id_refinamento} no armazenamento: {e}")
+
+
+def _buscar_refinamento(id_refinamento):
+	"""Estado de um refinamento: da memória desta instância ou, se iniciado em outra, do armazenamento."""
+	registro = resultados_refinamento.get(id_refinamento)
+	if registro is not None:
+		if registro['status'] != 'executando':
+			# O resultado é entregue uma única vez a partir da memória; a cópia no armazenamento continua disponível.
+			resultados_refinamento.pop(id_refinamento, None)
+		return registro
+	try:
+		return json.loads(obter_armazenamento().ler_texto(nome_resultado_refinamento(id_refinamento))[0])
+	except Exception:
+		return None
+
+
+def _executar_refinamento(id_refinamento, action, step, steps, opcoes_modelo, segmento):
+	"""
+	Executa em segundo plano a versão exata (dados completos) de uma análise pedida em modo 'preview'.
+	Roda em uma thread da instância que recebeu a prévia, depois da resposta: no Cloud Run é preciso
+	manter a CPU sempre alocada (--no-cpu-throttling), senão o refinamento só avança durante outras requisições.
+	"""
+	try:
+		if action == 'full_analysis':
+			data = executar_analise_completa(analisador, opcoes_modelo, segmento)
+		elif steps:
+			data = executar_etapas(analisador, steps, opcoes_modelo, segmento)
+		else:
+			data = executar_etapa(analisador, step, opcoes_modelo, segmento)
+		_registrar_refinamento(id_refinamento, {'status': 'concluido', 'data': data, 'timestamp': time.time()})
+		print(f"Refinamento {id_refinamento} concluído.")
+	except Exception as e:
+		print(f"Erro no refinamento {id_refinamento}: {e}")
+		_registrar_refinamento(id_refinamento, {'status': 'erro', 'error': str(e), 'timestamp': time.time()})
+
+
+# --- Memória compartilhada entre workers ---
+# Com SHARED_MATRIX_DIR (ex.: /dev/shm/cancelamentos), o primeiro worker carrega e publica a matriz
+# pré-processada como arquivos '.npy'; os demais (e ele próprio) a mapeiam em memória sem cópia.
+DIRETORIO_MEMORIA_COMPARTILHADA = os.environ.get('SHARED_MATRIX_DIR')
+
+
+def _versao_publicada(diretorio):
+	"""Versão apontada por 'atual.json' no diretório de memória compartilhada, ou None."""
+	try:
+		with open(os.path.join(diretorio, 'atual.json'), encoding='utf-8') as arquivo:
+			return json.load(arquivo)['versao']
+	except (OSError, ValueError, KeyError):
+		return None
+
+
+def publicar_dados_compartilhados(diretorio):
+	"""Carrega, pré-processa e treina em um analisador temporário e publica o resultado em memória compartilhada."""
+	carregador = AnalisadorCancelamentos()
+	if not carregador.carregar_dados() or not carregador.preprocessar_dados():
+		raise RuntimeError("Erro ao carregar ou pré-processar os dados para publicação em memória compartilhada.")
+	return carregador.publicar_memoria_compartilhada(diretorio)
+
+
+@contextmanager
+def _trava_memoria_compartilhada(diretorio, exclusiva=True):
+	"""
+	Trava de arquivo entre os workers: exclusiva para publicar, compartilhada para anexar
+	(impede que a versão sendo anexada seja removida por uma publicação simultânea).
+	"""
+	os.makedirs(diretorio, exist_ok=True)
+	with open(os.path.join(diretorio, '.trava'), 'w') as arquivo_trava:
+		fcntl.flock(arquivo_trava, fcntl.LOCK_EX if exclusiva else fcntl.LOCK_SH)
+		try:
+			yield
+		finally:
+			fcntl.flock(arquivo_trava, fcntl.LOCK_UN)
+
+
+def preparar_memoria_compartilhada():
+	"""
+	Anexa o analisador deste worker à matriz publicada mais recente. Se nada tiver sido publicado,
+	um único worker (sob uma trava de arquivo) faz o carregamento e a publicação enquanto os outros esperam.
+	Retorna False se a memória compartilhada não puder ser usada, para que o worker carregue os dados sozinho.
+	"""
+	diretorio = DIRETORIO_MEMORIA_COMPARTILHADA
+	try:
+		versao = _versao_publicada(diretorio)
+		if versao is None:
+			with _trava_memoria_compartilhada(diretorio):
+				versao = _versao_publicada(diretorio) or publicar_dados_compartilhados(diretorio)
+		if versao != analisador.versao_compartilhada:
+			with _trava_memoria_compartilhada(diretorio, exclusiva=False):
+				analisador.anexar_memoria_compartilhada(diretorio)
+		return True
+	except Exception as e:
+		print(f"Memória compartilhada indisponível, carregando dados localmente: {e}")
+		return False
+
+
+def incorporar_dados_compartilhados(arquivo_delta=None):
+	"""
+	'append_data' em modo compartilhado: sob a trava exclusiva, parte da versão publicada mais recente,
+	incorpora as novas linhas, republica a matriz e reanexa este worker a ela. Os demais workers
+	passam a usar a nova versão na próxima requisição, ao verem 'atual.json' alterado.
+	"""
+	diretorio = DIRETORIO_MEMORIA_COMPARTILHADA
+	with _trava_memoria_compartilhada(diretorio):
+		if _versao_publicada(diretorio) != analisador.versao_compartilhada:
+			analisador.anexar_memoria_compartilhada(diretorio)
+		estado_anterior = (analisador.offset_dados, dict(analisador.deltas_incorporados))
+		data = analisador.carregar_novos_dados(arquivo_delta)
+		if (analisador.offset_dados, analisador.deltas_incorporados) != estado_anterior:
+			analisador.publicar_memoria_compartilhada(diretorio)
+			analisador.anexar_memoria_compartilhada(diretorio)
+	data['versao_compartilhada'] = analisador.versao_compartilhada
+	return data
+
+
+# Artefato pré-calculado já baixado nesta instância, indexado pela geração do arquivo de dados.
+# Só a geração atual é mantida: cada artefato carrega várias imagens em Base64.
+artefatos_em_memoria = {}
+# Resultado negativo recente da busca (armazenamento inacessível ou artefato inexistente): (instante, geração).
+# Durante TTL_BUSCA_ARTEFATO segundos a busca não é repetida para a mesma situação.
+TTL_BUSCA_ARTEFATO = float(os.environ.get('PREBUILT_NEGATIVE_TTL_SECONDS', 30))
+_busca_artefato_negativa = None
+
+
+def buscar_artefato_preconstruido():
+	"""
+	Procura a 'full_analysis' pré-calculada para a geração atual de 'cancelamentos.csv'.
+	Retorna o JSON pronto para resposta, ou None se ainda não existir (ou se o GCS não estiver acessível).
+	Não consulta o armazenamento se o analisador já estiver usando dados de exemplo, nem se já tiver
+	incorporado arquivos delta: eles não mudam a geração do CSV, e o artefato não os incluiria.
+	"""
+	global _busca_artefato_negativa
+	if analisador.dados_exemplo or analisador.deltas_incorporados:
+		return None
+	if _busca_artefato_negativa and _busca_artefato_negativa[1] is None and time.time() - _busca_artefato_negativa[0] < TTL_BUSCA_ARTEFATO:
+		return None
+	try:
+		armazenamento = obter_armazenamento()
+		geracao = armazenamento.obter_geracao(NOME_ARQUIVO_DADOS) # Apenas metadados; o CSV não é lido.
+		if geracao is None:
+			return None
+		if geracao not in artefatos_em_memoria:
+			if _busca_artefato_negativa and _busca_artefato_negativa[1] == geracao and time.time() - _busca_artefato_negativa[0] < TTL_BUSCA_ARTEFATO:
+				return None
+			nome_artefato = nome_artefato_analise(geracao)
+			if not armazenamento.existe(nome_artefato):
+				_busca_artefato_negativa = (time.time(), geracao)
+				return None
+			artefato = armazenamento.ler_texto(nome_artefato)[0]
+			artefatos_em_memoria.clear()
+			artefatos_em_memoria[geracao] = artefato
+		print(f"Servindo análise pré-calculada para a geração {geracao}.")
+		return artefatos_em_memoria[geracao]
+	except Exception as e:
+		print(f"Análise pré-calculada indisponível: {e}")
+		_busca_artefato_negativa = (time.time(), None)
+		return None
+
+
+@functions_framework.cloud_event
+def precalcular_analise(cloud_event):
+	"""
+	Ponto de entrada acionado por eventos de finalização de objeto (google.cloud.storage.object.v1.finalized).
+	Quando uma nova geração de 'cancelamentos.csv' é gravada, executa a análise completa
+	antecipadamente e grava o artefato 'full_analysis' no armazenamento, indexado pela geração do objeto.
+	"""
+	dados_evento = cloud_event.data
+	nome_objeto = dados_evento.get('name')
+	geracao = dados_evento.get('generation')
+	bucket_evento = dados_evento.get('bucket')
+
+	# Ignora outros objetos, inclusive os próprios artefatos, para não gerar eventos em cascata.
+	if nome_objeto != NOME_ARQUIVO_DADOS:
+		print(f"Evento ignorado para o objeto: {nome_objeto}")
+		return
+	# Um objeto de mesmo nome em outro bucket não corresponde aos dados lidos por esta função.
+	if obter_armazenamento().nome == 'gcs' and bucket_evento != BUCKET_DADOS:
+		print(f"Evento ignorado: bucket '{bucket_evento}' diferente de '{BUCKET_DADOS}'.")
+		return
+
+	print(f"Pré-calculando análise completa para {nome_objeto}, geração {geracao}...")
+	inicio = time.time()
+	alvo = AnalisadorCancelamentos()
+	if not alvo.carregar_dados(geracao=geracao) or alvo.geracao_dados is None:
+		raise RuntimeError(f"Não foi possível carregar {nome_objeto} na geração {geracao}.")
+	if not alvo.preprocessar_dados():
+		raise RuntimeError("Erro no pré-processamento dos dados durante o pré-cálculo.")
+
+	resultado = {
+		'success': True,
+		'data': executar_analise_completa(alvo),
+		'precalculado': True,
+		'geracao_dados': str(alvo.geracao_dados),
+		'gerado_em': time.time()
+	}
+	obter_armazenamento().gravar_texto(
+		nome_artefato_analise(alvo.geracao_dados), json.dumps(resultado, ensure_ascii=False), content_type='application/json'
+	)
+	print(f"Artefato {nome_artefato_analise(alvo.geracao_dados)} gravado em {time.time() - inicio:.1f}s.")
+
+# --- Perfilamento sob demanda ---
+# Um perfil (cProfile + tracemalloc) é coletado quando a requisição traz "profile": true junto com o
+# cabeçalho X-Profile-Token igual a PROFILE_TOKEN, ou por amostragem com probabilidade PROFILE_SAMPLE_RATE.
+# PROFILE_OUTPUT é um diretório local ou 'storage://<prefixo>' para gravar pelo backend de armazenamento.
+TOKEN_PERFIL = os.environ.get('PROFILE_TOKEN')
+TAXA_AMOSTRAGEM_PERFIL = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+DESTINO_PERFIL = os.environ.get('PROFILE_OUTPUT', '/tmp/perfis')
+TOP_N_PERFIL = int(os.environ.get('PROFILE_TOP_N', 20))
+# O tracemalloc é global ao processo, então apenas uma requisição é perfilada por vez.
+trava_perfil = threading.Lock()
+
+
+def _token_valido(token_recebido, token_esperado):
+	"""Compara tokens em tempo constante. Sem token configurado, nenhum token é aceito."""
+	if not token_esperado or not token_recebido:
+		return False
+	return hmac.compare_digest(token_recebido.encode('utf-8'), token_esperado.encode('utf-8'))
+
+
+def _perfil_solicitado(request):
+	"""Decide se a requisição deve ser perfilada: pedido autenticado ou sorteio pela taxa de amostragem."""
+	if TAXA_AMOSTRAGEM_PERFIL > 0 and random.random() < TAXA_AMOSTRAGEM_PERFIL:
+		return True
+	if not TOKEN_PERFIL or request.method != 'POST':
+		return False
+	if not _token_valido(request.headers.get('X-Profile-Token'), TOKEN_PERFIL):
+		return False
+	request_json = request.get_json(silent=True) or {}
+	return bool(request_json.get('profile'))
+
+
+def _gravar_perfil(id_perfil, perfilador, resumo):
+	"""Grava o perfil binário (.prof, legível pelo pstats/snakeviz) e o resumo JSON no destino configurado."""
+	nome_prof, nome_resumo = f"perfil_{id_perfil}.prof", f"perfil_{id_perfil}.json"
+	texto_resumo = json.dumps(resumo, ensure_ascii=False, indent=1)
+	if DESTINO_PERFIL.startswith('storage://'):
+		prefixo = DESTINO_PERFIL[len('storage://'):].strip('/') or 'perfis'
+		perfilador.create_stats()
+		armazenamento = obter_armazenamento()
+		armazenamento.gravar_bytes(f"{prefixo}/{nome_prof}", marshal.dumps(perfilador.stats))
+		armazenamento.gravar_texto(f"{prefixo}/{nome_resumo}", texto_resumo, content_type='application/json')
+		return f"{armazenamento.nome}:{prefixo}/{nome_resumo}"
+	os.makedirs(DESTINO_PERFIL, exist_ok=True)
+	perfilador.dump_stats(os.path.join(DESTINO_PERFIL, nome_prof))
+	with open(os.path.join(DESTINO_PERFIL, nome_resumo), 'w', encoding='utf-8') as arquivo:
+		arquivo.write(texto_resumo)
+	return os.path.join(DESTINO_PERFIL, nome_resumo)
+
+
+def _processar_com_perfil(request):
+	"""Processa a requisição sob cProfile e tracemalloc e grava o perfil com o resumo das funções mais custosas."""
+	id_perfil = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+	perfilador = cProfile.Profile()
+	tracemalloc.start()
+	inicio = time.perf_counter()
+	_contexto_execucao.perfilando = True
+	perfilador.enable()
+	try:
+		resposta = _processar_requisicao(request)
+	finally:
+		perfilador.disable()
+		_contexto_execucao.perfilando = False
+		duracao = time.perf_counter() - inicio
+		memoria_atual, memoria_pico = tracemalloc.get_traced_memory()
+		alocacoes = tracemalloc.take_snapshot().statistics('lineno')[:TOP_N_PERFIL]
+		tracemalloc.stop()
+
+	try:
+		estatisticas = pstats.Stats(perfilador)
+		funcoes = []
+		for (arquivo, linha, funcao), (_, n_chamadas, tempo_proprio, tempo_acumulado, _) in estatisticas.stats.items():
+			funcoes.append({
+				'funcao': f"{os.path.basename(arquivo)}:{linha}({funcao})",
+				'chamadas': n_chamadas,
+				'tempo_proprio_s': round(tempo_proprio, 4),
+				'tempo_acumulado_s': round(tempo_acumulado, 4)
+			})
+		resumo = {
+			'id': id_perfil,
+			'duracao_s': round(duracao, 4),
+			'memoria_pico_mb': round(memoria_pico / 1024 ** 2, 2),
+			'memoria_final_mb': round(memoria_atual / 1024 ** 2, 2),
+			'top_tempo_acumulado': sorted(funcoes, key=lambda f: f['tempo_acumulado_s'], reverse=True)[:TOP_N_PERFIL],
+			'top_tempo_proprio': sorted(funcoes, key=lambda f: f['tempo_proprio_s'], reverse=True)[:TOP_N_PERFIL],
+			'top_alocacoes': [
+				{'local': str(estatistica.traceback), 'tamanho_kb': round(estatistica.size / 1024, 1), 'blocos': estatistica.count}
+				for estatistica in alocacoes
+			]
+		}
+		local = _gravar_perfil(id_perfil, perfilador, resumo)
+		print(f"Perfil {id_perfil} gravado em {local} ({duracao:.2f}s, pico de memória {resumo['memoria_pico_mb']} MB).")
+		if isinstance(resposta, tuple) and len(resposta) == 3:
+			resposta[2]['X-Profile-Id'] = id_perfil
+	except Exception as e:
+		print(f"Erro ao gravar perfil {id_perfil}: {e}")
+	return resposta
+
+
 @functions_framework.http
 def analisar_cancelamentos(request):
 	"""
 	Ponto de entrada principal da Cloud Function.
-	Processa requisições HTTP para realizar a análise de cancelamento de clientes.
+	Processa requisições HTTP para realizar a análise de cancelamento de clientes,
+	opcionalmente sob perfilamento (ver PROFILE_TOKEN e PROFILE_SAMPLE_RATE).
 	"""
+	if (TOKEN_PERFIL or TAXA_AMOSTRAGEM_PERFIL > 0) and _perfil_solicitado(request) and trava_perfil.acquire(blocking=False):
+		try:
+			return _processar_com_perfil(request)
+		finally:
+			trava_perfil.release()
+	return _processar_requisicao(request)
+
+
+def _parametro_booleano(valor, nome, padrao=False):
+	"""Lê um parâmetro booleano do JSON (true/false) ou da URL ('true', 'false', '1', '0'...)."""
+	if valor is None:
+		return padrao
+	if isinstance(valor, bool):
+		return valor
+	texto = str(valor).strip().lower()
+	if texto in ('true', '1', 'yes', 'sim', 'on'):
+		return True
+	if texto in ('false', '0', 'no', 'nao', 'não', 'off', ''):
+		return False
+	raise ValueError(f"Parâmetro '{nome}' deve ser booleano (true/false), recebido: {valor!r}.")
+
+
+def _parametro_inteiro(valor, nome, padrao=None, minimo=None):
+	"""Lê um parâmetro inteiro do JSON ou da URL, opcionalmente com valor mínimo."""
+	if valor is None or valor == '':
+		return padrao
+	if isinstance(valor, bool) or (isinstance(valor, float) and not valor.is_integer()):
+		raise ValueError(f"Parâmetro '{nome}' deve ser um número inteiro, recebido: {valor!r}.")
+	try:
+		numero = int(valor)
+	except (TypeError, ValueError):
+		raise ValueError(f"Parâmetro '{nome}' deve ser um número inteiro, recebido: {valor!r}.")
+	if minimo is not None and numero < minimo:
+		raise ValueError(f"Parâmetro '{nome}' deve ser no mínimo {minimo}, recebido: {numero}.")
+	return numero
+
+
+def _parametro_grade_c(valor):
+	"""Lê a grade de valores de 'C' (lista ou texto separado por vírgulas); todos devem ser números positivos."""
+	if valor is None or valor == '':
+		return None
+	if isinstance(valor, str):
+		valor = [item for item in valor.split(',') if item.strip()]
+	if not isinstance(valor, list) or not valor:
+		raise ValueError("Parâmetro 'c_grid' deve ser uma lista de números positivos, ex.: [0.1, 1, 10] ou '0.1,1,10'.")
+	if len(valor) > MAX_VALORES_GRADE_C:
+		raise ValueError(f"Parâmetro 'c_grid' aceita no máximo {MAX_VALORES_GRADE_C} valores.")
+	grade = []
+	for item in valor:
+		try:
+			c = float(item) if not isinstance(item, bool) else None
+		except (TypeError, ValueError):
+			c = None
+		if c is None or not np.isfinite(c) or c <= 0:
+			raise ValueError(f"Valor inválido em 'c_grid': {item!r}. Use números positivos.")
+		grade.append(c)
+	return sorted(set(grade))
+
+
+def _parametro_segmento(valor):
+	"""
+	Lê o filtro de segmento: um objeto {dimensão: valor ou lista de valores} sobre DIMENSOES_CUBO.
+	Em requisições GET, o objeto vem como texto JSON (ex.: segment={"assinatura":"Premium"}).
+	"""
+	if valor is None or valor == '' or valor == {}:
+		return None
+	if isinstance(valor, str):
+		try:
+			valor = json.loads(valor)
+		except ValueError:
+			valor = None
+	if not isinstance(valor, dict):
+		raise ValueError("Parâmetro 'segment' deve ser um objeto, ex.: {\"assinatura\": \"Premium\"}.")
+	segmento = {}
+	for dimensao, valores in valor.items():
+		if dimensao not in DIMENSOES_CUBO:
+			raise ValueError(f"Dimensão de segmento inválida: {dimensao}. Use uma de {DIMENSOES_CUBO}.")
+		valores = valores if isinstance(valores, list) else [valores]
+		if not valores or not all(isinstance(v, (str, int)) and not isinstance(v, bool) for v in valores):
+			raise ValueError(f"Valores do segmento para '{dimensao}' devem ser textos ou inteiros, ou uma lista deles.")
+		segmento[dimensao] = valores if len(valores) > 1 else valores[0]
+	return segmento
+
+
+def _validar_valores_segmento(df, segmento):
+	"""Confere se cada valor do segmento existe nos dados; levanta ValueError caso contrário."""
+	for dimensao, valores in segmento.items():
+		if dimensao not in df.columns:
+			raise ValueError(f"Dimensão de segmento '{dimensao}' não existe nos dados.")
+		existentes = set(df[dimensao].astype(str).unique())
+		desconhecidos = [v for v in (valores if isinstance(valores, list) else [valores]) if str(v) not in existentes]
+		if desconhecidos:
+			raise ValueError(f"Valores de segmento inexistentes para '{dimensao}': {desconhecidos}. Use um de {sorted(existentes)}.")
+
+
+def _processar_requisicao(request):
+	"""Processa uma requisição HTTP da análise de cancelamento (sem perfilamento)."""
 	# Lida com requisições OPTIONS (preflight CORS).
 	if request.method == 'OPTIONS':
 		headers = {
 			'Access-Control-Allow-Origin': '*',
 			'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-			'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+			'Access-Control-Allow-Headers': 'Content-Type, Authorization, X-Profile-Token, X-Append-Token',
 			'Access-Control-Max-Age': '3600'
 		}
 		return ('', 204, headers)
@@ -766,24 +2460,70 @@ def analisar_cancelamentos(request):
 				'error': 'Método não permitido'
 			}), 405, headers
 
-		# Tenta obter o JSON da requisição (para POST) ou usa um dicionário vazio (para GET).
+		# Tenta obter o JSON da requisição (para POST) ou usa os parâmetros da URL (para GET, ex.: ?action=health).
 		if request.method == 'POST':
 			request_json = request.get_json(silent=True) or {}
 		else:
-			request_json = {}
+			request_json = request.args.to_dict() if getattr(request, 'args', None) else {}
 
 		action = request_json.get('action', 'full_analysis') # Define a ação a ser executada.
 		step = request_json.get('step') # Mantém 'step' para compatibilidade, mas 'full_analysis' será o principal.
-
-		print(f"Iniciando análise - Action: {action}, Step: {step}")
-
-		# Carrega e pré-processa dados apenas se self.df ainda não estiver carregado.
-		if analisador.df is None:
+		# Lista arbitrária de etapas (ex.: ["insights", "fatores_risco"]), executadas pelo agendador de dependências.
+		steps = request_json.get('steps')
+		if isinstance(steps, str):
+			steps = [etapa.strip() for etapa in steps.split(',') if etapa.strip()]
+		# Flags e números chegam como texto em requisições GET e são convertidos explicitamente.
+		try:
+			# Parâmetros opcionais da seleção de modelo por validação cruzada.
+			opcoes_modelo = {
+				'selecao_modelo': _parametro_booleano(request_json.get('model_selection'), 'model_selection'),
+				'grade_c': _parametro_grade_c(request_json.get('c_grid')),
+				'n_folds': _parametro_inteiro(request_json.get('cv_folds'), 'cv_folds', minimo=2)
+			}
+			if opcoes_modelo['n_folds'] is not None and opcoes_modelo['n_folds'] > MAX_N_FOLDS:
+				raise ValueError(f"Parâmetro 'cv_folds' deve ser no máximo {MAX_N_FOLDS}.")
+			usar_preconstruido = _parametro_booleano(request_json.get('use_prebuilt'), 'use_prebuilt', padrao=True)
+			refinar = _parametro_booleano(request_json.get('refine'), 'refine')
+			tamanho_amostra = _parametro_inteiro(request_json.get('sample_size'), 'sample_size', TAMANHO_AMOSTRA_PREVIEW, minimo=1)
+			# Filtro opcional de segmento, ex.: {"assinatura": "Premium", "duracao_contrato": "Mensal"}.
+			segmento = _parametro_segmento(request_json.get('segment'))
+		except ValueError as e:
+			return json.dumps({'success': False, 'error': str(e)}), 400, headers
+
+		print(f"Iniciando análise - Action: {action}, Step: {step or steps}")
+
+		# 'append_data' altera o estado do serviço e exige o token de ingestão.
+		if action == 'append_data' and not _token_valido(request.headers.get('X-Append-Token'), TOKEN_INGESTAO):
+			return json.dumps({
+				'success': False,
+				'error': 'append_data requer o cabeçalho X-Append-Token válido (configure APPEND_TOKEN).'
+			}), 403, headers
+
+		acao_analise = action in ['full_analysis', 'step_analysis', 'append_data']
+		if acao_analise and DIRETORIO_MEMORIA_COMPARTILHADA and _versao_publicada(DIRETORIO_MEMORIA_COMPARTILHADA):
+			# Anexa à versão publicada antes da busca do artefato: ela pode incluir deltas que o artefato não tem.
+			with trava_pipeline:
+				preparar_memoria_compartilhada()
+
+		# Análise completa padrão: serve o artefato pré-calculado pelo 'precalcular_analise', se existir.
+		opcoes_padrao = not (request_json.get('mode') or segmento or opcoes_modelo['selecao_modelo'])
+		if action == 'full_analysis' and opcoes_padrao and usar_preconstruido:
+			artefato = buscar_artefato_preconstruido()
+			if artefato is not None:
+				return artefato, 200, headers
+
+		# Carrega e pré-processa dados apenas se self.df ainda não estiver carregado
+		# (e apenas para ações de análise; verificações de saúde não disparam o carregamento).
+		if acao_analise and DIRETORIO_MEMORIA_COMPARTILHADA and analisador.versao_compartilhada is None:
+			# Anexa (ou reanexa, se houve nova publicação) à matriz compartilhada entre os workers.
+			with trava_pipeline:
+				preparar_memoria_compartilhada()
+		if acao_analise and analisador.df is None:
 			print("Carregando e pré-processando dados pela primeira vez...")
 			if not analisador.carregar_dados():
 				return json.dumps({
 					'success': False,
-					'error': 'Erro crítico ao carregar dados. Verifique o GCS e permissões.'
+					'error': 'Erro crítico ao carregar dados. Verifique o armazenamento (GCS) e permissões.'
 				}), 500, headers
 
 			if not analisador.preprocessar_dados():
@@ -791,43 +2531,61 @@ def analisar_cancelamentos(request):
 					'success': False,
 					'error': 'Erro no pré-processamento dos dados'
 				}), 500, headers
-		else:
+		elif acao_analise:
 			print("Dados já carregados e pré-processados. Reutilizando DataFrame e divisões existentes.")
 
-		resultado_data = {}
+		# Modo 'preview': executa o pipeline sobre uma amostra estratificada, com intervalos de confiança.
+		preview = request_json.get('mode') == 'preview' and action in ['full_analysis', 'step_analysis']
+		alvo = analisador
+		if preview:
+			print(f"Modo preview: amostra estratificada de {tamanho_amostra} registros.")
+			alvo = analisador.criar_amostra_estratificada(tamanho_amostra)
+			if alvo is None:
+				return json.dumps({
+					'success': False,
+					'error': 'Erro ao criar a amostra estratificada para o modo preview'
+				}), 500, headers
+
+		if segmento and acao_analise:
+			try:
+				_validar_valores_segmento(analisador.df, segmento)
+			except ValueError as e:
+				return json.dumps({'success': False, 'error': str(e)}), 400, headers
+
+		# A validação cruzada estratificada precisa de pelo menos um exemplo de cada classe por fold.
+		if opcoes_modelo['selecao_modelo'] and opcoes_modelo['n_folds'] and alvo.y_train is not None:
+			menor_classe = int(alvo.y_train.value_counts().min())
+			if opcoes_modelo['n_folds'] > menor_classe:
+				return json.dumps({
+					'success': False,
+					'error': f"Parâmetro 'cv_folds' ({opcoes_modelo['n_folds']}) excede o número de exemplos da menor classe no treino ({menor_classe})."
+				}), 400, headers
+
 		if action == 'full_analysis':
 			print("Executando análise completa...")
+			resultado = {
+				'success': True,
+				'data': executar_analise_completa(alvo, opcoes_modelo, segmento)
+			}
 
-			resultado_data['analise_exploratoria'] = analisador.analise_exploratoria()
-			resultado_data['distribuicoes'] = analisador.gerar_distribuicoes()
-			resultado_data['associacoes'] = analisador.analisar_associacoes()
-			resultado_data['modelo'] = analisador.construir_modelo()
-			resultado_data['fatores_risco'] = analisador.analisar_fatores_risco()
-			resultado_data['call_center_impact'] = analisador.analisar_impacto_callcenter() 
-			resultado_data['insights'] = analisador.gerar_insights()
+		elif action == 'step_analysis' and steps:
+			print(f"Executando etapas: {steps}...")
+			invalidas = [etapa for etapa in steps if etapa not in ETAPAS]
+			if invalidas:
+				return json.dumps({
+					'success': False,
+					'error': f'Etapas inválidas: {invalidas}'
+				}), 400, headers
 
 			resultado = {
 				'success': True,
-				'data': resultado_data
+				'data': executar_etapas(alvo, steps, opcoes_modelo, segmento)
 			}
 
 		elif action == 'step_analysis' and step: # Permite execução de etapas específicas.
 			print(f"Executando etapa específica: {step}...")
-			if step == 'exploratorio':
-				data = analisador.analise_exploratoria()
-			elif step == 'distribuicoes':
-				data = analisador.gerar_distribuicoes()
-			elif step == 'associacoes':
-				data = analisador.analisar_associacoes()
-			elif step == 'modelo':
-				data = analisador.construir_modelo()
-			elif step == 'fatores_risco':
-				data = analisador.analisar_fatores_risco()
-			elif step == 'call_center_impact':
-				data = analisador.analisar_impacto_callcenter()
-			elif step == 'insights':
-				data = analisador.gerar_insights()
-			else:
+			data = executar_etapa(alvo, step, opcoes_modelo, segmento)
+			if data is None:
 				return json.dumps({
 					'success': False,
 					'error': f'Etapa inválida: {step}'
@@ -837,6 +2595,45 @@ def analisar_cancelamentos(request):
 				'success': True,
 				'data': data
 			}
+
+		elif action == 'append_data': # Incorpora linhas anexadas ao arquivo (ou um arquivo delta) sem reprocessar a base.
+			try:
+				with trava_pipeline:
+					if DIRETORIO_MEMORIA_COMPARTILHADA and analisador.versao_compartilhada:
+						data = incorporar_dados_compartilhados(request_json.get('delta_file'))
+					else:
+						data = analisador.carregar_novos_dados(request_json.get('delta_file'))
+			except FileNotFoundError as e:
+				return json.dumps({'success': False, 'error': str(e)}), 404, headers
+			except ValueError as e:
+				return json.dumps({'success': False, 'error': str(e)}), 400, headers
+			resultado = {
+				'success': True,
+				'data': data
+			}
+
+		elif action == 'memory_report': # Uso de memória deste worker e quais estruturas estão em memória compartilhada.
+			resultado = {
+				'success': True,
+				'data': analisador.relatorio_memoria()
+			}
+
+		elif action == 'refinement_status': # Consulta o resultado exato de um refinamento disparado por uma prévia.
+			id_refinamento = str(request_json.get('refinement_id') or '')
+			if len(id_refinamento) != 32 or any(c not in '0123456789abcdef' for c in id_refinamento):
+				return json.dumps({
+					'success': False,
+					'error': f'refinement_id inválido: {id_refinamento}'
+				}), 400, headers
+			_limpar_refinamentos()
+			registro = _buscar_refinamento(id_refinamento)
+			if registro is None:
+				return json.dumps({
+					'success': False,
+					'error': f'Refinamento não encontrado: {id_refinamento}'
+				}), 404, headers
+			resultado = {'success': True, 'refinement_id': id_refinamento}
+			resultado.update(registro)
 		else:
 			resultado = {
 				'success': True,
@@ -844,6 +2641,25 @@ def analisar_cancelamentos(request):
 				'timestamp': time.time()
 			}
 
+		if preview:
+			resultado['mode'] = 'preview'
+			resultado['preview'] = {
+				'tamanho_amostra': int(len(alvo.df)),
+				'total_registros': int(alvo.info_amostra['total_populacao']),
+				'intervalos_confianca': alvo.calcular_intervalos_preview()
+			}
+			# Opcionalmente dispara a execução exata, que substitui a prévia quando terminar.
+			if refinar:
+				id_refinamento = uuid.uuid4().hex
+				_limpar_refinamentos()
+				_registrar_refinamento(id_refinamento, {'status': 'executando', 'timestamp': time.time()})
+				threading.Thread(
+					target=_executar_refinamento,
+					args=(id_refinamento, action, step, steps, opcoes_modelo, segmento),
+					daemon=True
+				).start()
+				resultado['refinement_id'] = id_refinamento
+
 		return json.dumps(resultado, ensure_ascii=False), 200, headers
 
 	except Exception as e:
@@ -860,7 +2676,27 @@ if __name__ == "__main__":
 	"""
 	Bloco para execução local do servidor Flask, simulando a Cloud Function.
 	Permite testar o código localmente antes do deploy.
+	Com o argumento 'precalcular [geracao]', simula um evento de upload e executa o pré-cálculo.
+	Com o argumento 'publicar', carrega os dados e publica a matriz em SHARED_MATRIX_DIR para os workers.
 	"""
+	import sys
+	from types import SimpleNamespace
+
+	if len(sys.argv) > 1 and sys.argv[1] == 'precalcular':
+		evento = SimpleNamespace(data={
+			'bucket': BUCKET_DADOS,
+			'name': NOME_ARQUIVO_DADOS,
+			'generation': sys.argv[2] if len(sys.argv) > 2 else None
+		})
+		precalcular_analise(evento)
+		sys.exit(0)
+
+	if len(sys.argv) > 1 and sys.argv[1] == 'publicar':
+		if not DIRETORIO_MEMORIA_COMPARTILHADA:
+			sys.exit("Defina SHARED_MATRIX_DIR com o diretório de publicação (ex.: /dev/shm/cancelamentos).")
+		publicar_dados_compartilhados(DIRETORIO_MEMORIA_COMPARTILHADA)
+		sys.exit(0)
+
 	from flask import Flask, request as flask_request
 
 	app = Flask(__name__)
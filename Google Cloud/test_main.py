@@ -0,0 +1,283 @@
+"""
+Testes de regressão da análise de cancelamentos. Executar com: python -m pytest -q
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import main
+
+
+COLUNAS_ESTRATO = ['cancelou', 'sexo', 'assinatura', 'duracao_contrato']
+
+
+@pytest.fixture(scope='module')
+def populacao():
+	analisador = main.AnalisadorCancelamentos()
+	analisador.criar_dados_exemplo(n_samples=20000)
+	assert analisador.preprocessar_dados()
+	return analisador
+
+
+def test_media_estratificada_alinha_estratos_da_amostra_e_da_populacao(populacao):
+	"""A média da prévia deve ser a soma de (N_h / N) * média_h, com cada estrato pareado ao seu próprio N_h."""
+	amostra = populacao.criar_amostra_estratificada(500)
+	intervalos = amostra.calcular_intervalos_preview()
+
+	total = len(populacao.df)
+	for col in ['ligacoes_callcenter', 'idade', 'total_gasto']:
+		estimativa = 0.0
+		variancia = 0.0
+		for chave, grupo_populacao in populacao.df.groupby(COLUNAS_ESTRATO):
+			filtro = (amostra.df[COLUNAS_ESTRATO] == chave).all(axis=1)
+			valores = amostra.df.loc[filtro, col]
+			n_h, tamanho_h = len(valores), len(grupo_populacao)
+			peso = tamanho_h / total
+			estimativa += peso * valores.mean()
+			if n_h > 1:
+				variancia += peso ** 2 * (1 - n_h / tamanho_h) * valores.var(ddof=1) / n_h
+
+		resultado = intervalos['medias'][col]
+		assert resultado['estimativa'] == pytest.approx(estimativa, abs=0.005)
+		assert resultado['erro_padrao'] == pytest.approx(variancia ** 0.5, abs=0.00005)
+
+
+def _dados_exemplo(n_registros):
+	gerador = main.AnalisadorCancelamentos()
+	gerador.criar_dados_exemplo(n_samples=n_registros)
+	return gerador.df
+
+
+@pytest.fixture
+def armazenamento_local(tmp_path):
+	main.definir_armazenamento(main.ArmazenamentoLocal(str(tmp_path)))
+	yield tmp_path
+	main.definir_armazenamento(None)
+
+
+def _analisador_do_armazenamento():
+	analisador = main.AnalisadorCancelamentos()
+	assert analisador.carregar_dados() and not analisador.dados_exemplo
+	assert analisador.preprocessar_dados()
+	return analisador
+
+
+@pytest.mark.parametrize('fim_de_linha', ['\n', '\r\n'])
+def test_append_por_offset_incorpora_somente_linhas_novas(armazenamento_local, fim_de_linha):
+	caminho = armazenamento_local / main.NOME_ARQUIVO_DADOS
+	_dados_exemplo(300).to_csv(caminho, index=False, lineterminator=fim_de_linha)
+	analisador = _analisador_do_armazenamento()
+	assert analisador.offset_dados == caminho.stat().st_size
+
+	with open(caminho, 'a', newline='') as arquivo:
+		_dados_exemplo(10).to_csv(arquivo, header=False, index=False, lineterminator=fim_de_linha)
+	resultado = analisador.carregar_novos_dados()
+	assert resultado['novas_linhas'] == 10
+	assert resultado['total_registros'] == 310
+	assert resultado['offset'] == caminho.stat().st_size
+
+	# Sem nada novo, não relê nem duplica linhas.
+	assert analisador.carregar_novos_dados()['novas_linhas'] == 0
+
+	# Uma linha parcial (sem quebra de linha) espera ser completada.
+	linha = _dados_exemplo(1).to_csv(header=False, index=False, lineterminator=fim_de_linha)
+	with open(caminho, 'a', newline='') as arquivo:
+		arquivo.write(linha[:-len(fim_de_linha)])
+	assert analisador.carregar_novos_dados()['novas_linhas'] == 0
+	with open(caminho, 'a', newline='') as arquivo:
+		arquivo.write(fim_de_linha)
+	assert analisador.carregar_novos_dados()['novas_linhas'] == 1
+	assert len(analisador.df) == len(analisador.X_processed) == 311
+
+
+def test_append_por_offset_rejeita_arquivo_substituido(armazenamento_local):
+	_dados_exemplo(300).to_csv(armazenamento_local / main.NOME_ARQUIVO_DADOS, index=False)
+	analisador = _analisador_do_armazenamento()
+	_dados_exemplo(5).to_csv(armazenamento_local / main.NOME_ARQUIVO_DADOS, index=False)
+	with pytest.raises(ValueError):
+		analisador.carregar_novos_dados()
+
+
+def test_delta_e_incorporado_uma_unica_vez(armazenamento_local):
+	_dados_exemplo(300).to_csv(armazenamento_local / main.NOME_ARQUIVO_DADOS, index=False)
+	(armazenamento_local / main.PREFIXO_DELTAS).mkdir()
+	_dados_exemplo(10).to_csv(armazenamento_local / main.PREFIXO_DELTAS / 'lote.csv', index=False, lineterminator='\r\n')
+	analisador = _analisador_do_armazenamento()
+
+	assert analisador.carregar_novos_dados('lote.csv')['novas_linhas'] == 10
+	repetido = analisador.carregar_novos_dados('lote.csv')
+	assert repetido['novas_linhas'] == 0 and repetido['ja_incorporado']
+	assert len(analisador.df) == 310
+
+
+@pytest.mark.parametrize('arquivo_delta', ['../cancelamentos.csv', '/etc/hostname', 'a/../../x.csv', ''])
+def test_delta_fora_do_prefixo_e_rejeitado(arquivo_delta):
+	with pytest.raises(ValueError):
+		main.nome_arquivo_delta(arquivo_delta)
+
+
+def test_estatisticas_mescladas_igualam_recalculo_completo(armazenamento_local):
+	_dados_exemplo(500).to_csv(armazenamento_local / main.NOME_ARQUIVO_DADOS, index=False)
+	analisador = _analisador_do_armazenamento()
+	for tamanho in [40, 1, 25]:
+		analisador.incorporar_novas_linhas(_dados_exemplo(tamanho))
+
+	mescladas = analisador.estatisticas_incrementais
+	bordas = {col: estado['bordas'] for col, estado in mescladas['numericas'].items()}
+	completas = analisador._estatisticas_lote(analisador.df, bordas)
+
+	assert mescladas['n'] == completas['n'] == 566
+	assert mescladas['cancelados'] == completas['cancelados']
+	assert mescladas['validos'] == completas['validos']
+	for col, esperado in completas['numericas'].items():
+		obtido = mescladas['numericas'][col]
+		assert obtido['n'] == esperado['n']
+		assert obtido['media'] == pytest.approx(esperado['media'])
+		assert obtido['m2'] == pytest.approx(esperado['m2'])
+		assert (obtido['min'], obtido['max']) == (esperado['min'], esperado['max'])
+		assert list(obtido['histograma']) == list(esperado['histograma'])
+	for col, esperado in completas['contingencia'].items():
+		assert mescladas['contingencia'][col].equals(esperado)
+
+	exploratoria = analisador.analise_exploratoria()
+	assert exploratoria['total_registros'] == len(analisador.df)
+	assert exploratoria['taxa_cancelamento'] == round(float(analisador.df['cancelou'].mean()) * 100, 2)
+
+
+@pytest.mark.parametrize('segmento', [
+	{'assinatura': 'Premium'},
+	{'sexo': 'F', 'duracao_contrato': ['Mensal', 'Anual']}
+])
+def test_cubo_de_segmentos_iguala_filtro_das_linhas(populacao, segmento):
+	filtro = np.ones(len(populacao.df), dtype=bool)
+	for dimensao, valores in segmento.items():
+		filtro &= populacao.df[dimensao].astype(str).isin(valores if isinstance(valores, list) else [valores]).to_numpy()
+	linhas = populacao.df[filtro]
+
+	exploratoria = populacao.analise_exploratoria(segmento)
+	assert exploratoria['total_registros'] == len(linhas)
+	assert exploratoria['registros_validos'] == len(linhas.dropna())
+	assert exploratoria['taxa_cancelamento'] == round(float(linhas['cancelou'].mean()) * 100, 2)
+	for col, resumo in exploratoria['resumo_numerico'].items():
+		assert resumo['media'] == round(float(linhas[col].mean()), 2)
+		assert resumo['desvio_padrao'] == pytest.approx(float(linhas[col].std(ddof=0)), abs=0.01)
+		assert (resumo['minimo'], resumo['maximo']) == (round(float(linhas[col].min()), 2), round(float(linhas[col].max()), 2))
+		assert sum(resumo['histograma']['contagens']) == len(linhas)
+
+	for col in ['sexo', 'assinatura', 'duracao_contrato']:
+		tabela_cubo = populacao._tabela_contingencia(col, segmento)
+		tabela_linhas = pd.crosstab(linhas[col], linhas['cancelou'])
+		tabela_cubo.index = tabela_cubo.index.astype(str)
+		tabela_linhas.index = tabela_linhas.index.astype(str)
+		assert tabela_cubo.sort_index().to_numpy().tolist() == tabela_linhas.sort_index().to_numpy().tolist()
+
+	distribuicoes = populacao.gerar_distribuicoes(segmento)
+	assert distribuicoes['idade_media'] == round(float(linhas['idade'].mean()), 2)
+	assert distribuicoes['gasto_medio'] == round(float(linhas['total_gasto'].mean()), 2)
+
+
+@pytest.mark.parametrize('paralelo', [False, True])
+def test_agendador_treina_o_modelo_uma_unica_vez(monkeypatch, paralelo):
+	monkeypatch.setattr(main, 'ETAPAS_PARALELAS', paralelo)
+	treinamentos = []
+	treinar_modelo = main.AnalisadorCancelamentos.treinar_modelo
+
+	def treinar_e_contar(self, *args, **kwargs):
+		treinamentos.append(1)
+		return treinar_modelo(self, *args, **kwargs)
+
+	monkeypatch.setattr(main.AnalisadorCancelamentos, 'treinar_modelo', treinar_e_contar)
+	analisador = main.AnalisadorCancelamentos()
+	analisador.criar_dados_exemplo(n_samples=2000)
+	assert analisador.preprocessar_dados()
+
+	# Várias etapas dependem do modelo; ele é ajustado uma vez por execução.
+	resultados = main.executar_etapas(analisador, ['fatores_risco', 'call_center_impact', 'insights'])
+	assert len(treinamentos) == 1
+	assert all('erro' not in resultado for resultado in resultados.values())
+
+	# Sem a etapa 'modelo', o modelo existente é reaproveitado.
+	main.executar_etapas(analisador, ['insights', 'fatores_risco'])
+	assert len(treinamentos) == 1
+
+	# A análise completa refaz o treinamento, mas apenas uma vez.
+	main.executar_analise_completa(analisador)
+	assert len(treinamentos) == 2
+
+
+def test_parametros_de_url_sao_convertidos_explicitamente():
+	assert main._parametro_booleano('false', 'flag', padrao=True) is False
+	assert main._parametro_booleano('1', 'flag') is True
+	assert main._parametro_booleano(None, 'flag', padrao=True) is True
+	assert main._parametro_inteiro('5', 'n') == 5
+	assert main._parametro_inteiro(None, 'n', padrao=3) == 3
+	for valor in ['talvez', '2']:
+		with pytest.raises(ValueError):
+			main._parametro_booleano(valor, 'flag')
+	for valor in ['abc', '2.5', True]:
+		with pytest.raises(ValueError):
+			main._parametro_inteiro(valor, 'n')
+	with pytest.raises(ValueError):
+		main._parametro_inteiro('0', 'n', minimo=1)
+
+
+def test_grade_c_e_validada_e_cache_da_validacao_cruzada_e_limitado():
+	assert main._parametro_grade_c('1, 0.1,1') == [0.1, 1.0]
+	assert main._parametro_grade_c([10, 0.5]) == [0.5, 10.0]
+	for valor in ['abc', '-1', [0], ['inf'], {}, [True]]:
+		with pytest.raises(ValueError):
+			main._parametro_grade_c(valor)
+
+	analisador = main.AnalisadorCancelamentos()
+	analisador.criar_dados_exemplo(n_samples=600)
+	assert analisador.preprocessar_dados()
+	for i in range(main.MAX_CACHE_VALIDACAO_CRUZADA + 3):
+		analisador.selecionar_regularizacao([0.1 * (i + 1)], 2)
+	assert len(analisador.cache_validacao_cruzada) == main.MAX_CACHE_VALIDACAO_CRUZADA
+
+	# Uma nova versão dos dados descarta os resultados da versão anterior.
+	analisador.versao_dados = 'nova_versao'
+	analisador.selecionar_regularizacao([1.0], 2)
+	assert list(analisador.cache_validacao_cruzada) == [('nova_versao', (1.0,), 2)]
+
+
+def test_registros_validos_do_segmento_seguem_o_dropna():
+	analisador = main.AnalisadorCancelamentos()
+	analisador.criar_dados_exemplo(n_samples=500)
+	assert analisador.preprocessar_dados()
+	analisador.df['observacao'] = np.where(np.arange(len(analisador.df)) % 7 == 0, np.nan, 1.0)
+
+	segmento = {'assinatura': 'Basic'}
+	linhas = analisador.df[analisador.df['assinatura'] == 'Basic']
+	exploratoria = analisador.analise_exploratoria(segmento)
+	assert exploratoria['registros_validos'] == len(linhas.dropna()) < exploratoria['total_registros']
+
+
+def test_segmento_e_validado_antes_da_analise(populacao):
+	assert main._parametro_segmento('{"assinatura": "Premium"}') == {'assinatura': 'Premium'}
+	assert main._parametro_segmento({'sexo': ['F', 'M']}) == {'sexo': ['F', 'M']}
+	assert main._parametro_segmento(None) is None
+	for valor in ['Premium', ['assinatura'], {'plano': 'x'}, {'assinatura': []}, {'assinatura': {'a': 1}}, {'sexo': True}]:
+		with pytest.raises(ValueError):
+			main._parametro_segmento(valor)
+	with pytest.raises(ValueError):
+		main._validar_valores_segmento(populacao.df, {'assinatura': 'Gold'})
+	main._validar_valores_segmento(populacao.df, {'assinatura': 'Premium', 'cancelou': 1})
+
+
+def test_refinamento_concluido_e_visivel_em_outra_instancia():
+	main.definir_armazenamento(main.ArmazenamentoMemoria())
+	try:
+		id_refinamento = 'a' * 32
+		main._registrar_refinamento(id_refinamento, {'status': 'concluido', 'data': {'total_registros': 10}, 'timestamp': 0})
+		# Simula outra instância, sem o resultado em memória.
+		main.resultados_refinamento.clear()
+		registro = main._buscar_refinamento(id_refinamento)
+		assert registro['status'] == 'concluido' and registro['data'] == {'total_registros': 10}
+		assert main._buscar_refinamento('b' * 32) is None
+	finally:
+		main.definir_armazenamento(None)
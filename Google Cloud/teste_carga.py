@@ -0,0 +1,193 @@
+"""
+Teste de carga ponta a ponta da Cloud Function de análise de cancelamentos.
+
+Para cada tamanho de dataset, gera um 'cancelamentos.csv' sintético em um diretório temporário,
+sobe o servidor Flask do bloco '__main__' de main.py com o armazenamento local (STORAGE_BACKEND=local)
+e dispara requisições concorrentes com uma mistura configurável de ações. Ao final, imprime
+(ou grava) um relatório JSON com vazão, latências p50/p95/p99 e taxa de erros.
+
+Exemplo:
+	python teste_carga.py --concurrency 8 --requests 200 --sizes 1000,10000 --mix full_analysis=1,step_analysis=4,health=2
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DIRETORIO_FUNCAO = os.path.dirname(os.path.abspath(__file__))
+ETAPAS = ['exploratorio', 'distribuicoes', 'associacoes', 'modelo', 'fatores_risco', 'call_center_impact', 'insights']
+
+
+def interpretar_mistura(texto):
+	"""Converte 'full_analysis=1,step_analysis=4,health=2' em um dicionário de pesos."""
+	mistura = {}
+	for item in texto.split(','):
+		acao, _, peso = item.partition('=')
+		mistura[acao.strip()] = float(peso or 1)
+	acoes_invalidas = set(mistura) - {'full_analysis', 'step_analysis', 'health'}
+	if acoes_invalidas:
+		raise ValueError(f"Ações inválidas na mistura: {sorted(acoes_invalidas)}")
+	return mistura
+
+
+def gerar_dataset(diretorio, n_registros):
+	"""Grava um 'cancelamentos.csv' sintético com 'n_registros' linhas, usando o gerador de main.py."""
+	sys.path.insert(0, DIRETORIO_FUNCAO)
+	from main import AnalisadorCancelamentos, NOME_ARQUIVO_DADOS
+
+	analisador = AnalisadorCancelamentos()
+	analisador.criar_dados_exemplo(n_samples=n_registros)
+	analisador.df.to_csv(os.path.join(diretorio, NOME_ARQUIVO_DADOS), index=False)
+
+
+def requisitar(url, acao, timeout):
+	"""Executa uma requisição e retorna (ação, latência em segundos, sucesso)."""
+	rotulo = acao['rotulo']
+	inicio = time.perf_counter()
+	try:
+		if acao['metodo'] == 'GET':
+			requisicao = urllib.request.Request(f"{url}?action=health", method='GET')
+		else:
+			requisicao = urllib.request.Request(
+				url, data=json.dumps(acao['corpo']).encode('utf-8'),
+				headers={'Content-Type': 'application/json'}, method='POST'
+			)
+		with urllib.request.urlopen(requisicao, timeout=timeout) as resposta:
+			corpo = json.loads(resposta.read().decode('utf-8'))
+			sucesso = resposta.status < 400 and corpo.get('success', False)
+	except (urllib.error.URLError, OSError, ValueError):
+		sucesso = False
+	return rotulo, time.perf_counter() - inicio, sucesso
+
+
+def sortear_acoes(mistura, n_requisicoes, semente):
+	"""Sorteia a sequência de requisições conforme os pesos da mistura."""
+	rng = random.Random(semente)
+	acoes = []
+	for rotulo in rng.choices(list(mistura), weights=list(mistura.values()), k=n_requisicoes):
+		if rotulo == 'health':
+			acoes.append({'rotulo': rotulo, 'metodo': 'GET'})
+		elif rotulo == 'full_analysis':
+			acoes.append({'rotulo': rotulo, 'metodo': 'POST', 'corpo': {'action': 'full_analysis'}})
+		else:
+			acoes.append({'rotulo': rotulo, 'metodo': 'POST', 'corpo': {'action': 'step_analysis', 'step': rng.choice(ETAPAS)}})
+	return acoes
+
+
+def resumir(latencias, sucessos):
+	"""Resume latências (em ms) e erros de um conjunto de requisições."""
+	latencias_ms = np.array(latencias) * 1000
+	total = len(latencias_ms)
+	erros = int(total - sum(sucessos))
+	return {
+		'requisicoes': total,
+		'erros': erros,
+		'taxa_erro': round(erros / total, 4) if total else 0.0,
+		'latencia_ms': {
+			'media': round(float(latencias_ms.mean()), 1) if total else None,
+			'p50': round(float(np.percentile(latencias_ms, 50)), 1) if total else None,
+			'p95': round(float(np.percentile(latencias_ms, 95)), 1) if total else None,
+			'p99': round(float(np.percentile(latencias_ms, 99)), 1) if total else None
+		}
+	}
+
+
+def aguardar_servidor(url, processo, timeout):
+	"""Espera o servidor responder à verificação de saúde."""
+	limite = time.time() + timeout
+	while time.time() < limite:
+		if processo.poll() is not None:
+			raise RuntimeError(f"O servidor encerrou durante a inicialização (código {processo.returncode}).")
+		try:
+			with urllib.request.urlopen(f"{url}?action=health", timeout=2):
+				return
+		except (urllib.error.URLError, OSError):
+			time.sleep(0.5)
+	raise RuntimeError(f"O servidor não respondeu em {timeout}s.")
+
+
+def executar_cenario(n_registros, args, mistura):
+	"""Sobe o servidor com um dataset de 'n_registros' linhas, aplica a carga e retorna o resumo."""
+	with tempfile.TemporaryDirectory() as diretorio:
+		gerar_dataset(diretorio, n_registros)
+		ambiente = dict(os.environ, STORAGE_BACKEND='local', LOCAL_STORAGE_DIR=diretorio, PORT=str(args.port))
+		saida = open(args.server_log, 'a') if args.server_log else subprocess.DEVNULL
+
+		if args.precalcular:
+			subprocess.run([sys.executable, 'main.py', 'precalcular'], cwd=DIRETORIO_FUNCAO, env=ambiente,
+						   stdout=saida, stderr=subprocess.STDOUT, check=True)
+
+		processo = subprocess.Popen([sys.executable, 'main.py'], cwd=DIRETORIO_FUNCAO, env=ambiente,
+									stdout=saida, stderr=subprocess.STDOUT)
+		url = f"http://127.0.0.1:{args.port}/"
+		try:
+			aguardar_servidor(url, processo, args.startup_timeout)
+			acoes = sortear_acoes(mistura, args.requests, args.seed)
+
+			inicio = time.perf_counter()
+			with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+				resultados = list(executor.map(lambda acao: requisitar(url, acao, args.timeout), acoes))
+			duracao = time.perf_counter() - inicio
+		finally:
+			processo.terminate()
+			processo.wait(timeout=30)
+			if saida is not subprocess.DEVNULL:
+				saida.close()
+
+	resumo = {
+		'tamanho_dataset': n_registros,
+		'duracao_s': round(duracao, 2),
+		'vazao_rps': round(len(resultados) / duracao, 2) if duracao else None
+	}
+	resumo.update(resumir([r[1] for r in resultados], [r[2] for r in resultados]))
+	resumo['por_acao'] = {
+		rotulo: resumir([r[1] for r in resultados if r[0] == rotulo], [r[2] for r in resultados if r[0] == rotulo])
+		for rotulo in sorted({r[0] for r in resultados})
+	}
+	return resumo
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Teste de carga HTTP da análise de cancelamentos.')
+	parser.add_argument('--concurrency', type=int, default=4, help='Número de requisições simultâneas.')
+	parser.add_argument('--requests', type=int, default=50, help='Total de requisições por tamanho de dataset.')
+	parser.add_argument('--mix', default='full_analysis=1,step_analysis=4,health=2', help='Pesos das ações: acao=peso,...')
+	parser.add_argument('--sizes', default='1000,10000', help='Tamanhos de dataset (registros), separados por vírgula.')
+	parser.add_argument('--port', type=int, default=8090)
+	parser.add_argument('--timeout', type=float, default=300, help='Timeout de cada requisição, em segundos.')
+	parser.add_argument('--startup-timeout', type=float, default=60)
+	parser.add_argument('--precalcular', action='store_true', help='Pré-calcula a full_analysis antes de subir o servidor.')
+	parser.add_argument('--seed', type=int, default=42)
+	parser.add_argument('--server-log', help='Arquivo para a saída do servidor (descartada por padrão).')
+	parser.add_argument('--output', help='Arquivo para gravar o relatório JSON (padrão: saída padrão).')
+	args = parser.parse_args()
+
+	mistura = interpretar_mistura(args.mix)
+	relatorio = {
+		'configuracao': {
+			'concorrencia': args.concurrency,
+			'requisicoes_por_cenario': args.requests,
+			'mistura': mistura,
+			'precalculado': args.precalcular
+		},
+		'cenarios': [executar_cenario(int(n), args, mistura) for n in args.sizes.split(',')]
+	}
+
+	texto = json.dumps(relatorio, ensure_ascii=False, indent=2)
+	if args.output:
+		with open(args.output, 'w', encoding='utf-8') as arquivo:
+			arquivo.write(texto)
+	print(texto)
+
+
+if __name__ == '__main__':
+	main()